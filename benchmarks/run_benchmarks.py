@@ -0,0 +1,211 @@
+"""
+Benchmarks for the documentation generator, run against synthetic factories from synthetic_factory.py.
+
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Comparing exits with 1 when any benchmark's best time is slower than the baseline by more than the tolerance, so it
+can gate a release. Baselines are machine specific; save one on the machine that does the comparing
+"""
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import initiator  # noqa: E402
+from synthetic_factory import make_factory, make_pipeline, parse_type_mix  # noqa: E402
+
+PARSERS = {
+    'Lookup': initiator.parse_lookup,
+    'IfCondition': initiator.parse_ifcondition,
+    'SqlServerStoredProcedure': initiator.parse_sproc,
+    'WebActivity': initiator.parse_webactivity,
+    'Wait': initiator.parse_waitactivity,
+    'Delete': initiator.parse_deleteactivity,
+    'Copy': initiator.parse_copyactivity,
+    'DatabricksNotebook': initiator.parse_notebook,
+    'GetMetadata': initiator.parse_getmetadata,
+    'ExecutePipeline': initiator.parse_executepipeline,
+}
+
+
+MIN_ROUND_TIME = 0.05
+
+
+def measure(func: Callable, rounds: int) -> Dict[str, float]:
+    """
+    Times a function with its output silenced. Like timeit, fast functions are looped within a round until the
+    round takes at least MIN_ROUND_TIME, so tiny benchmarks are not dominated by timer noise.
+    The garbage collector is off while timing, also like timeit, so a collection doesn't land in a single round
+
+    :return: the min, median and max time of a single call in seconds
+    """
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            loops = 1
+            while True:
+                start = time.perf_counter()
+                for _ in range(loops):
+                    func()
+                elapsed = time.perf_counter() - start
+                if elapsed >= MIN_ROUND_TIME:
+                    break
+                loops *= 10 if elapsed < MIN_ROUND_TIME / 10 else 2
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(loops):
+                    func()
+                timings.append((time.perf_counter() - start) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {'min': min(timings), 'median': statistics.median(timings), 'max': max(timings), 'rounds': rounds,
+            'loops': loops}
+
+
+def _collect_activities(node, activities_by_type: dict):
+    if isinstance(node, dict):
+        if node.get('type') in PARSERS and 'typeProperties' in node:
+            activities_by_type.setdefault(node['type'], []).append(node)
+        for value in node.values():
+            _collect_activities(value, activities_by_type)
+    elif isinstance(node, list):
+        for value in node:
+            _collect_activities(value, activities_by_type)
+
+
+def _parse_all(parser, activities: list):
+    for activity in activities:
+        details = parser.parse(activity)
+        if details is not None:
+            details.render()
+
+
+def run(pipelines: int, activities: int, nesting_depth: int, parameter_count: int, rounds: int,
+        seed: int = 0, type_mix: Dict[str, int] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Runs every benchmark against one synthetic factory
+
+    :param type_mix: activity type to relative weight. Defaults to the synthetic factory's DEFAULT_TYPE_MIX
+    :return: benchmark name to its timings
+    """
+    factory = make_factory(pipelines, activities, nesting_depth, type_mix=type_mix, parameter_count=parameter_count,
+                           seed=seed)
+    pipeline = make_pipeline(activities=activities * 5, nesting_depth=nesting_depth, type_mix=type_mix,
+                             parameter_count=parameter_count, seed=seed)
+    factory_text = json.dumps(factory)
+    factory_bytes = factory_text.encode('utf-8')
+    rows = initiator.ADFPipelineDocGenerator().parse_document(factory)
+    activities_by_type = {}
+    _collect_activities(factory, activities_by_type)
+    formatting = initiator.get_rest_rows_formatting(1, [''] * len(initiator.DOC_HEADERS))
+
+    def resolve_instructions():
+        for row_idx in range(len(rows)):
+            for col_idx in range(len(initiator.DOC_HEADERS)):
+                initiator.ExcelUtils._convert_instructions_to_formats(formatting, row_idx, col_idx)
+
+    benchmarks = {
+        'json_load': lambda: json.loads(factory_text),
+        'decode_json': lambda: initiator.decode_json(factory_bytes),
+        'recursive_parsing': lambda: initiator.ADFPipelineDocGenerator().parse_document(factory),
+        'recursive_parsing_Individual': lambda: initiator.ADFPipelineDocGenerator().parse_document(pipeline),
+        'instruction_resolution': resolve_instructions,
+    }
+    for activity_type, parser in PARSERS.items():
+        if activities_by_type.get(activity_type):
+            benchmarks['parse_{}'.format(activity_type)] = \
+                lambda p=parser, a=activities_by_type[activity_type]: _parse_all(p, a)
+    for output_format in ('xlsx', 'csv', 'jsonl'):
+        benchmarks['write_{}'.format(output_format)] = \
+            lambda f=output_format: initiator.generate(factory, io.BytesIO(), initiator.GenerateOptions(f))
+
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = measure(func, rounds)
+        print('{:<40} median {:>10.2f} ms   min {:>10.2f} ms'.format(name, results[name]['median'] * 1000,
+                                                                      results[name]['min'] * 1000))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Finds the benchmarks whose best time got slower than the baseline by more than `tolerance` (0.2 is 20%). The
+    minimum is compared rather than the median since it is the least affected by whatever else the machine is doing
+
+    :return: a list of (name, baseline time, current time) of the regressions
+    """
+    regressions = []
+    for name, timings in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print('{:<40} no baseline'.format(name))
+            continue
+        change = timings['min'] / base['min'] - 1 if base['min'] else 0.0
+        flag = 'REGRESSION' if change > tolerance else ''
+        print('{:<40} {:>+8.1%} {}'.format(name, change, flag))
+        if flag:
+            regressions.append((name, base['min'], timings['min']))
+    return regressions
+
+
+def main(argv=None) -> int:
+    import argparse
+    arg_parser = argparse.ArgumentParser(description='Benchmarks the ADF documentation generator')
+    arg_parser.add_argument('--pipelines', type=int, default=200)
+    arg_parser.add_argument('--activities', type=int, default=20, help='top level activities per pipeline')
+    arg_parser.add_argument('--nesting-depth', type=int, default=2)
+    arg_parser.add_argument('--parameters', type=int, default=8, help='parameters per activity')
+    arg_parser.add_argument('--rounds', type=int, default=5)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--type-mix', help='activity type weights, e.g. Copy=3,Lookup=1. Defaults to a mix of '
+                                               'every supported type')
+    arg_parser.add_argument('--save-baseline', metavar='PATH', help='save the results as a baseline json file')
+    arg_parser.add_argument('--compare', metavar='PATH', help='compare the results against a baseline json file')
+    arg_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed slowdown against the baseline before failing. Defaults to 0.2 (20%%)')
+    args = arg_parser.parse_args(argv)
+    try:
+        type_mix = parse_type_mix(args.type_mix) if args.type_mix else None
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+    results = run(args.pipelines, args.activities, args.nesting_depth, args.parameters, args.rounds, args.seed,
+                  type_mix)
+    report = {
+        'config': {'pipelines': args.pipelines, 'activities': args.activities, 'nesting_depth': args.nesting_depth,
+                   'parameters': args.parameters, 'rounds': args.rounds, 'seed': args.seed, 'type_mix': type_mix},
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Saved baseline to {}'.format(args.save_baseline))
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print('Warning: the baseline was run with a different config: {}'.format(baseline.get('config')))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print('{} benchmark(s) regressed by more than {:.0%}'.format(len(regressions), args.tolerance))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
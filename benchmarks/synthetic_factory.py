@@ -0,0 +1,233 @@
+"""
+Deterministic generator of synthetic Azure Data Factory ARM templates and single pipeline files, used by the
+benchmarks. The same arguments (including the seed) always produce the same json
+"""
+import json
+import random
+import sys
+from typing import Dict
+
+DEFAULT_TYPE_MIX = {
+    'SqlServerStoredProcedure': 3,
+    'Lookup': 2,
+    'Copy': 3,
+    'DatabricksNotebook': 2,
+    'GetMetadata': 1,
+    'WebActivity': 1,
+    'Wait': 1,
+    'Delete': 1,
+    'IfCondition': 1,
+    'ExecutePipeline': 1,
+}
+
+
+def parse_type_mix(text: str) -> Dict[str, int]:
+    """
+    Parses a type mix given on the command line, e.g. "Copy=3,Lookup=1"
+
+    :param text: comma separated activity type=weight pairs
+    :return: activity type to relative weight
+    """
+    type_mix = {}
+    for pair in text.split(','):
+        activity_type, _, weight = pair.strip().partition('=')
+        if activity_type not in DEFAULT_TYPE_MIX:
+            raise ValueError("Unknown activity type {}, expected one of {}".format(
+                activity_type, ', '.join(DEFAULT_TYPE_MIX)))
+        try:
+            type_mix[activity_type] = int(weight)
+        except ValueError:
+            raise ValueError("The weight of {} must be a whole number, got '{}'".format(activity_type, weight))
+        if type_mix[activity_type] < 0:
+            raise ValueError("The weight of {} can't be negative".format(activity_type))
+    if not any(type_mix.values()):
+        raise ValueError("At least one activity type needs a weight above 0")
+    return type_mix
+
+
+def _parameters(rng: random.Random, count: int, nested: bool) -> dict:
+    params = {}
+    for idx in range(count):
+        value = 'value_{}_{}'.format(idx, rng.randint(0, 10 ** 6))
+        if rng.random() < 0.3:
+            value = {'value': "@pipeline().parameters.p{}".format(idx), 'type': 'Expression'}
+        params['param_{}'.format(idx)] = {'value': value, 'type': 'String'} if nested else value
+    return params
+
+
+def make_activity(rng: random.Random, name: str, activity_type: str, parameter_count: int,
+                  depends_on: str = None, children: list = None) -> dict:
+    """
+    Builds the json of a single activity of the given type
+
+    :param rng: the random generator to draw values from
+    :param name: the activity name
+    :param activity_type: one of the keys of DEFAULT_TYPE_MIX
+    :param parameter_count: how many parameters/fields the activity gets, where its type has any
+    :param depends_on: the name of the activity this one depends on
+    :param children: nested activities, only used by IfCondition
+    :return: the activity as a dictionary
+    """
+    activity = {'name': name, 'type': activity_type, 'dependsOn': [], 'userProperties': []}
+    if depends_on:
+        activity['dependsOn'].append({'activity': depends_on, 'dependencyConditions': ['Succeeded']})
+
+    if activity_type == 'SqlServerStoredProcedure':
+        type_properties = {'storedProcedureName': '[dbo].[usp_{}]'.format(name),
+                           'storedProcedureParameters': _parameters(rng, parameter_count, nested=True)}
+    elif activity_type == 'Lookup':
+        type_properties = {'source': {'type': 'SqlDWSource',
+                                      'sqlReaderStoredProcedureName': '[dbo].[usp_lookup_{}]'.format(name),
+                                      'storedProcedureParameters': _parameters(rng, parameter_count, nested=True)},
+                           'dataset': {'referenceName': 'ds_lookup', 'type': 'DatasetReference'}}
+    elif activity_type == 'Copy':
+        activity['inputs'] = [{'referenceName': 'ds_in_{}'.format(rng.randint(0, 50)), 'type': 'DatasetReference'}]
+        activity['outputs'] = [{'referenceName': 'ds_out_{}'.format(rng.randint(0, 50)), 'type': 'DatasetReference'}]
+        if rng.random() < 0.5:
+            source = {'type': 'SqlDWSource', 'sqlReaderStoredProcedureName': '[dbo].[usp_src_{}]'.format(name)}
+        else:
+            source = {'type': 'DelimitedTextSource',
+                      'storeSettings': {'type': 'AzureBlobFSReadSettings', 'recursive': True,
+                                        'wildcardFolderPath': 'landing/{}'.format(name),
+                                        'wildcardFileName': '*.csv'}}
+        type_properties = {'source': source, 'sink': {'type': 'SqlDWSink'}}
+    elif activity_type == 'DatabricksNotebook':
+        type_properties = {'notebookPath': '/Shared/{}'.format(name),
+                           'baseParameters': _parameters(rng, parameter_count, nested=False)}
+    elif activity_type == 'GetMetadata':
+        type_properties = {'dataset': {'referenceName': 'ds_meta', 'type': 'DatasetReference'},
+                           'fieldList': ['field_{}'.format(idx) for idx in range(parameter_count)]}
+    elif activity_type == 'WebActivity':
+        type_properties = {'url': 'https://example.invalid/{}'.format(name), 'method': 'POST',
+                           'headers': {'Content-Type': 'application/json'},
+                           'body': json.dumps(_parameters(rng, parameter_count, nested=False))}
+    elif activity_type == 'Wait':
+        type_properties = {'waitTimeInSeconds': rng.randint(1, 600)}
+    elif activity_type == 'Delete':
+        type_properties = {'dataset': {'referenceName': 'ds_delete', 'type': 'DatasetReference'},
+                           'storeSettings': {'type': 'AzureBlobFSReadSettings', 'wildcardFileName': '*.tmp'}}
+    elif activity_type == 'ExecutePipeline':
+        type_properties = {'pipeline': {'referenceName': 'PL_Child_{}'.format(rng.randint(0, 50)),
+                                        'type': 'PipelineReference'},
+                           'waitOnCompletion': True}
+    elif activity_type == 'IfCondition':
+        type_properties = {'expression': {'value': "@equals(pipeline().parameters.flag, '1')",
+                                          'type': 'Expression'},
+                           'ifTrueActivities': children or []}
+    else:
+        raise ValueError("Unknown activity type {}".format(activity_type))
+    activity['typeProperties'] = type_properties
+    return activity
+
+
+def make_pipeline_activities(rng: random.Random, prefix: str, activities: int, nesting_depth: int,
+                             type_mix: Dict[str, int], parameter_count: int) -> list:
+    """
+    Builds a chain of activities where each one depends on the previous one. IfCondition activities get a nested
+    chain of their own, down to `nesting_depth` levels
+    """
+    types = list(type_mix)
+    weights = [type_mix[activity_type] for activity_type in types]
+    result = []
+    previous = None
+    for idx in range(activities):
+        name = '{}_{}'.format(prefix, idx)
+        activity_type = rng.choices(types, weights)[0]
+        children = None
+        if activity_type == 'IfCondition':
+            if nesting_depth > 0:
+                children = make_pipeline_activities(rng, name, max(1, activities // 4), nesting_depth - 1,
+                                                    type_mix, parameter_count)
+            else:
+                activity_type = 'Wait'
+        result.append(make_activity(rng, name, activity_type, parameter_count, previous, children))
+        previous = name
+    return result
+
+
+def make_pipeline(name: str = 'PL_Synthetic', activities: int = 20, nesting_depth: int = 1,
+                  type_mix: Dict[str, int] = None, parameter_count: int = 5, seed: int = 0) -> dict:
+    """
+    Builds a single pipeline file, the input of ADFPipelineDocGenerator.recursive_parsing_Individual
+    """
+    rng = random.Random(seed)
+    return {
+        'name': name,
+        'properties': {
+            'activities': make_pipeline_activities(rng, name, activities, nesting_depth, type_mix or DEFAULT_TYPE_MIX,
+                                                   parameter_count),
+            'annotations': [],
+        },
+    }
+
+
+def make_factory(pipelines: int = 50, activities: int = 20, nesting_depth: int = 1, type_mix: Dict[str, int] = None,
+                 parameter_count: int = 5, seed: int = 0) -> dict:
+    """
+    Builds an ARM template with `pipelines` pipelines (plus a few non pipeline resources that the parser skips)
+
+    :param pipelines: the number of pipelines
+    :param activities: the number of top level activities per pipeline
+    :param nesting_depth: how many levels of IfCondition activities can nest inside each other
+    :param type_mix: activity type to relative weight. Defaults to DEFAULT_TYPE_MIX
+    :param parameter_count: the number of parameters (or fields) per activity
+    :param seed: the random seed
+    :return: the ARM template as a dictionary
+    """
+    rng = random.Random(seed)
+    type_mix = type_mix or DEFAULT_TYPE_MIX
+    resources = []
+    for idx in range(pipelines):
+        name = 'PL_{:05d}'.format(idx)
+        resources.append({
+            'name': "[concat(parameters('factoryName'), '/{}')]".format(name),
+            'type': 'Microsoft.DataFactory/factories/pipelines',
+            'apiVersion': '2018-06-01',
+            'properties': {
+                'activities': make_pipeline_activities(rng, name, activities, nesting_depth, type_mix,
+                                                       parameter_count),
+                'annotations': [],
+            },
+            'dependsOn': [],
+        })
+        if idx % 10 == 0:
+            resources.append({'name': "[concat(parameters('factoryName'), '/ds_{}')]".format(idx),
+                              'type': 'Microsoft.DataFactory/factories/datasets', 'properties': {}})
+    return {
+        '$schema': 'http://schema.management.azure.com/schemas/2015-01-01/deploymentTemplate.json#',
+        'contentVersion': '1.0.0.0',
+        'parameters': {'factoryName': {'type': 'string'}},
+        'resources': resources,
+    }
+
+
+def main(argv=None):
+    import argparse
+    arg_parser = argparse.ArgumentParser(description='Writes a synthetic ADF ARM template (or pipeline) to a file')
+    arg_parser.add_argument('output', help='the json file to write')
+    arg_parser.add_argument('--pipelines', type=int, default=50)
+    arg_parser.add_argument('--activities', type=int, default=20)
+    arg_parser.add_argument('--nesting-depth', type=int, default=1)
+    arg_parser.add_argument('--parameters', type=int, default=5)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--type-mix', help='activity type weights, e.g. Copy=3,Lookup=1. Defaults to a mix of '
+                                               'every supported type')
+    arg_parser.add_argument('--single-pipeline', action='store_true', help='write a single pipeline file instead')
+    args = arg_parser.parse_args(argv)
+    try:
+        type_mix = parse_type_mix(args.type_mix) if args.type_mix else None
+    except ValueError as e:
+        arg_parser.error(str(e))
+    if args.single_pipeline:
+        data = make_pipeline(activities=args.activities, nesting_depth=args.nesting_depth, type_mix=type_mix,
+                             parameter_count=args.parameters, seed=args.seed)
+    else:
+        data = make_factory(args.pipelines, args.activities, args.nesting_depth, type_mix=type_mix,
+                            parameter_count=args.parameters, seed=args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(data, f, indent=4)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
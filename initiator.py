@@ -1,14 +1,35 @@
+from abc import ABC, abstractmethod
+import contextlib
+import functools
+import hashlib
+import operator
+from array import array
+from collections import Counter, OrderedDict
+import io
 import json
+import mmap
+import threading
+import time
 from datetime import date, datetime
-import pathlib, os, sys
-import xlrd
-import xlsxwriter
-from django.db.models import QuerySet
+import os, sys
 from enum import Enum
-from typing import List, Union, Dict, Tuple
-from django.db import models
+from typing import List, Union, Dict, Tuple, BinaryIO, Iterator, Callable
 from decimal import Decimal
-import copy
+
+# xlrd, xlsxwriter, openpyxl, django and the fast json backends are imported where they are used, so documenting a
+# factory to a non-Excel output never pays for them and django is never imported unless the caller already uses it
+
+
+def _is_queryset(values) -> bool:
+    """
+    isinstance(values, QuerySet) without importing django. If django's models were never imported, the values
+    can't be a QuerySet
+    """
+    if 'django.db.models' not in sys.modules:
+        return False
+    from django.db.models import QuerySet
+    return isinstance(values, QuerySet)
+
 
 class DBUtility:
     """
@@ -59,8 +80,8 @@ class DBUtility:
         return cls
 
     @staticmethod
-    def get_table_columns(table_name: Union[str, models.Model], ignore_list: List[str] = None,
-                          to_fetch: List[str] = None) -> Dict[str, models.Field]:
+    def get_table_columns(table_name: Union[str, 'models.Model'], ignore_list: List[str] = None,
+                          to_fetch: List[str] = None) -> Dict[str, 'models.Field']:
         """
         Gets a dictionary of the model fields and their corresponding types in the DB for a specific table. Returns
         something like:
@@ -97,7 +118,7 @@ class DBUtility:
         return model_fields
 
     @staticmethod
-    def convert_column_type(column_type: models.fields_all) -> str:
+    def convert_column_type(column_type: 'models.fields_all') -> str:
         """
         Converts the column type from the original django db model field to a string representation which can be
         passed onto external services. Example, a db CharField will convert to a 'string' field and a DB decimal field
@@ -138,7 +159,7 @@ class DBUtility:
         return ' '.join(x)
 
     @staticmethod
-    def bulk_update_orm(orm_cls: models.Model, id_list: List[int], column_name: str, new_value,
+    def bulk_update_orm(orm_cls: 'models.Model', id_list: List[int], column_name: str, new_value,
                         apply_func_instructions=None) -> Tuple[bool, List]:
         """
         Takes in an ORM class and applies a bulk update to a specific column in the ORM class with a new value
@@ -204,7 +225,8 @@ class DBUtility:
     def serialize(obj):
         """
         Serializes any object so it can be returned to the frontend. At the time of writing this it will do strict
-        conversions for datetime objects, Decimals, and BigInts. Bytes objects will return a None type when serialized
+        conversions for datetime objects, Decimals, and BigInts. Bytes objects will return a None type when serialized.
+        Parsed activity details are rendered to their text
 
         :param obj: the object to serialize
         :return: the serialized type which can be converted to JSON. Returns None if no serializer value can be found
@@ -213,6 +235,8 @@ class DBUtility:
             return obj.strftime('%m/%d/%Y')
         if isinstance(obj, Decimal):
             return float(obj)
+        if isinstance(obj, ActivityDetails):
+            return obj.render()
         if isinstance(obj, str) or isinstance(obj, int) or isinstance(obj, dict) \
                 or isinstance(obj, bool) or isinstance(obj, float):
             return obj
@@ -273,6 +297,38 @@ class FontStyle(Enum):
         return False
 
 
+class ValueRange:
+
+    def __init__(self, low=None, high=None, inclusive: bool = True):
+        """
+        A range predicate for ExcelUtils.iter_rows. `value in ValueRange(...)` is True when the value lies between
+        low and high. Values which can't be compared to the bounds (a string in a number range for instance) are
+        never in the range
+
+        :param low: the lower bound. None leaves the range open at the bottom
+        :param high: the upper bound. None leaves the range open at the top
+        :param inclusive: whether the bounds themselves are part of the range
+        """
+        self.low = low
+        self.high = high
+        self.inclusive = inclusive
+
+    def __contains__(self, value) -> bool:
+        try:
+            if self.low is not None:
+                if value < self.low or (not self.inclusive and value == self.low):
+                    return False
+            if self.high is not None:
+                if value > self.high or (not self.inclusive and value == self.high):
+                    return False
+        except TypeError:
+            return False
+        return True
+
+    def __repr__(self):
+        return 'ValueRange(low={}, high={}, inclusive={})'.format(self.low, self.high, self.inclusive)
+
+
 class Formatter:
 
     def __init__(self, cell_str_format: str = None, font_styles: List[FontStyle] = None,
@@ -297,6 +353,20 @@ class Formatter:
     # def style(self):
     #     return self.xf_style
 
+    def key(self) -> tuple:
+        """
+        :return: a hashable key that is the same for formatters which produce the same cell format
+        """
+        return (self.cell_str_format, self._key_values(self.font_styles), self._key_values(self.cell_borders),
+                self.text_color, self.bg_color)
+
+    @staticmethod
+    def _key_values(values) -> Union[tuple, None]:
+        # FontStyle and CellBorder aren't hashable, and set_format treats a member the same as its value
+        if values is None:
+            return None
+        return tuple(value.value if isinstance(value, Enum) else value for value in values)
+
     def set_format(self, input_format:format) -> Union[str, None]:
 
         if self.cell_str_format is not None:
@@ -331,15 +401,424 @@ class Formatter:
                     input_format.set_right(2)
 
 
+ACCEPTED_DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%SZ',
+    '%m/%d/%Y %H:%M%SZ',
+    '%Y-%m-%d',
+    '%m/%d/%Y',
+    '%m/%d',
+    '%m-%d',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y %I:%M',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d %I:%M'
+]
+
+XLSX_SIGNATURE = b'PK\x03\x04'
+
+BAD_DATE_FORMATS = [
+    '%m-%Y-%d',
+    '%m-%Y',
+    '%m-%Y-%d %H:%M'
+]
+
+
+class DateColumnParser:
+    """
+    Converts the values of one date column to datetime objects for ExcelUtils.iter_rows. The string format of the
+    column is inferred once from a sample of its values and tried first for every cell, with a fromisoformat fast
+    path for ISO dates. Only values that don't fit the inferred format go through the full ExcelUtils.is_datetime
+    search. Results are memoized since the same dates tend to repeat down a column
+    """
+    SAMPLE_SIZE = 25
+    SAMPLE_ROWS = 1000  # the most rows looked at for samples, so a column of real dates never scans the whole sheet
+    MEMO_SIZE = 10000
+    # formats whose strings fromisoformat parses to the same (naive) datetime as strptime, by string length
+    _ISO_FORMATS = {'%Y-%m-%d': 10, '%Y-%m-%d %H:%M': 16, '%Y-%m-%d %I:%M': 16}
+
+    def __init__(self, datemode: int, col_idx: int):
+        """
+        :param datemode: the datemode of the workbook, used for numeric excel dates
+        :param col_idx: the index of the column, only used in error messages
+        """
+        self.datemode = datemode
+        self.col_idx = col_idx
+        self.date_format = None
+        self._iso_length = None
+        self._memo = {}
+
+    def infer_format(self, samples: List[str]) -> Union[str, None]:
+        """
+        Picks the accepted format which parses the most sample values. Ties go to the format listed first in
+        ACCEPTED_DATE_FORMATS, like is_datetime does
+
+        :param samples: string values of the column
+        :return: the inferred format or None if no sample parsed
+        """
+        best_format, best_count = None, 0
+        for accepted_format in ACCEPTED_DATE_FORMATS:
+            count = 0
+            for sample in samples:
+                try:
+                    datetime.strptime(sample, accepted_format)
+                    count += 1
+                except ValueError:
+                    pass
+            if count > best_count:
+                best_format, best_count = accepted_format, count
+        self.date_format = best_format
+        self._iso_length = self._ISO_FORMATS.get(best_format)
+        return best_format
+
+    def parse(self, cell_val):
+        """
+        Converts a cell value to a datetime object. Numbers are excel dates, empty cells are None and strings are
+        parsed like ExcelUtils.is_datetime would
+
+        :param cell_val: the cell value
+        :return: the datetime, or None if the value is empty or not a date
+        """
+        if cell_val is None or cell_val == '':
+            return None
+        if isinstance(cell_val, datetime):  # .xlsx date cells are already read as datetimes
+            return cell_val
+        is_number = isinstance(cell_val, int) or isinstance(cell_val, float)
+        if not is_number and not isinstance(cell_val, str):
+            raise RuntimeError("Expected a Date field in column {}. Got {} value "
+                               "instead".format(self.col_idx + 1, cell_val))
+        try:
+            return self._memo[cell_val]
+        except KeyError:
+            pass
+        if is_number:
+            from xlrd import xldate_as_datetime
+            result = xldate_as_datetime(cell_val, self.datemode)
+        else:
+            result = self._parse_string(cell_val)
+        if len(self._memo) < self.MEMO_SIZE:
+            self._memo[cell_val] = result
+        return result
+
+    def _parse_string(self, value: str):
+        # fromisoformat also takes a 'T' (or any other character) between the date and the time, which the
+        # strptime formats don't, so only a space is let through
+        if self._iso_length == len(value) and value[4] == '-' and value[7] == '-' \
+                and (self._iso_length == 10 or (value[10] == ' ' and value[13] == ':')):
+            try:
+                result = datetime.fromisoformat(value)
+                if result.tzinfo is None:
+                    return result
+            except ValueError:
+                pass
+        if self.date_format is not None:
+            try:
+                return datetime.strptime(value, self.date_format)
+            except ValueError:
+                pass
+        is_datetime, result = ExcelUtils.is_datetime(value)
+        return result
+
+
+class XlsxStreamingSheet:
+    """
+    An xlrd-like sheet over an openpyxl read-only worksheet. Rows are streamed out of the sheet xml as they are
+    asked for and only the current row is kept, so memory stays flat however big the sheet is. Reading forward
+    (which is what iter_rows, read_sheet and build_index do) costs one pass over the sheet; going back to an
+    earlier row restarts the stream. Empty cells read as '' like they do in xlrd.
+
+    Some producers write a wrong <dimension> record (often just A1), so the size of the sheet is never taken from
+    it: nrows and ncols count the rows in one streaming pass the first time either is asked for
+    """
+
+    def __init__(self, worksheet):
+        worksheet.reset_dimensions()
+        self._worksheet = worksheet
+        self.name = worksheet.title
+        self._nrows = None
+        self._ncols = None
+        self._rows = None
+        self._row_idx = -1
+        self._row = None
+
+    @property
+    def nrows(self) -> int:
+        if self._nrows is None:
+            self._count()
+        return self._nrows
+
+    @property
+    def ncols(self) -> int:
+        if self._ncols is None:
+            self._count()
+        return self._ncols
+
+    def _count(self):
+        nrows = ncols = 0
+        for row in self._worksheet.iter_rows(values_only=True):
+            nrows += 1
+            ncols = max(ncols, len(row))
+        self._nrows, self._ncols = nrows, ncols
+
+    def iter_row_values(self) -> Iterator[list]:
+        """
+        Streams every row of the sheet in one pass, without counting the rows first
+        """
+        for row in self._worksheet.iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+
+    def _get_row(self, row_idx: int) -> list:
+        if row_idx < 0 or row_idx >= self.nrows:
+            raise IndexError("row index {} out of range for sheet {}".format(row_idx, self.name))
+        if self._rows is None or row_idx < self._row_idx:
+            self._rows = self._worksheet.iter_rows(min_row=row_idx + 1, values_only=True)
+            self._row_idx = row_idx - 1
+        while self._row_idx < row_idx:
+            row = next(self._rows, None)
+            self._row = [] if row is None else ['' if value is None else value for value in row]
+            self._row_idx += 1
+        return self._row
+
+    def row_len(self, row_idx: int) -> int:
+        return len(self._get_row(row_idx))
+
+    def cell_value(self, row_idx: int, col_idx: int):
+        return self._get_row(row_idx)[col_idx]
+
+    def row_values(self, row_idx: int, start_colx: int = 0, end_colx: int = None) -> list:
+        row = self._get_row(row_idx)
+        return row[start_colx:end_colx]
+
+    def unload(self):
+        self._rows = None
+        self._row_idx = -1
+        self._row = None
+
+
+class XlsxStreamingBook:
+    """
+    An xlrd-like workbook over openpyxl in read-only mode, used by ExcelUtils for .xlsx files since xlrd can no
+    longer read them. openpyxl reads straight out of the zip without building the cell model
+    """
+
+    def __init__(self, path_or_file):
+        """
+        :param path_or_file: a path or a binary file-like object of an .xlsx workbook
+        """
+        try:
+            import openpyxl
+        except ImportError:
+            raise RuntimeError("Reading .xlsx workbooks needs openpyxl to be installed")
+        self._workbook = openpyxl.load_workbook(path_or_file, read_only=True, data_only=True)
+        self.datemode = 1 if self._workbook.epoch.year == 1904 else 0
+        self._sheets = {}
+
+    def sheet_names(self) -> List[str]:
+        return self._workbook.sheetnames
+
+    def sheet_by_name(self, sheet_name: str) -> XlsxStreamingSheet:
+        if sheet_name not in self._sheets:
+            if sheet_name not in self._workbook.sheetnames:
+                raise RuntimeError("No sheet named <{}>".format(sheet_name))
+            self._sheets[sheet_name] = XlsxStreamingSheet(self._workbook[sheet_name])
+        return self._sheets[sheet_name]
+
+    def sheet_by_index(self, sheet_idx: int) -> XlsxStreamingSheet:
+        return self.sheet_by_name(self._workbook.sheetnames[sheet_idx])
+
+    def unload_sheet(self, sheet_name: str):
+        sheet = self._sheets.get(sheet_name)
+        if sheet is not None:
+            sheet.unload()
+
+    def release_resources(self):
+        self._workbook.close()
+        self._sheets = {}
+
+    @staticmethod
+    def is_xlsx(path: str = None, raw_file=None) -> bool:
+        """
+        Whether a file is an .xlsx (zip) workbook rather than an .xls one, going by its first bytes
+        """
+        if path:
+            with open(path, 'rb') as f:
+                head = f.read(4)
+        elif isinstance(raw_file, (bytes, bytearray)):
+            head = bytes(raw_file[:4])
+        else:
+            position = raw_file.tell()
+            head = raw_file.read(4)
+            raw_file.seek(position)
+        return head == XLSX_SIGNATURE
+
+
+class MaterializedSheet:
+    """
+    A fully loaded, read-only sheet kept by the WorkbookCache for .xlsx workbooks. Nothing mutates it after it is
+    built so any number of threads can read it at once
+    """
+
+    def __init__(self, name: str, rows: List[tuple]):
+        self.name = name
+        self._rows = rows
+        self.nrows = len(rows)
+        self.ncols = max((len(row) for row in rows), default=0)
+
+    def row_len(self, row_idx: int) -> int:
+        return len(self._rows[row_idx])
+
+    def cell_value(self, row_idx: int, col_idx: int):
+        return self._rows[row_idx][col_idx]
+
+    def row_values(self, row_idx: int, start_colx: int = 0, end_colx: int = None) -> list:
+        return list(self._rows[row_idx][start_colx:end_colx])
+
+
+class MaterializedBook:
+
+    def __init__(self, streaming_book: XlsxStreamingBook):
+        """
+        Reads every sheet of a streaming .xlsx workbook into memory and closes it
+
+        :param streaming_book: the open workbook to load
+        """
+        self.datemode = streaming_book.datemode
+        self._sheet_names = list(streaming_book.sheet_names())
+        self._sheets = {}
+        try:
+            for sheet_name in self._sheet_names:
+                sheet = streaming_book.sheet_by_name(sheet_name)
+                rows = [tuple(row) for row in sheet.iter_row_values()]
+                self._sheets[sheet_name] = MaterializedSheet(sheet_name, rows)
+        finally:
+            streaming_book.release_resources()
+
+    def sheet_names(self) -> List[str]:
+        return list(self._sheet_names)
+
+    def sheet_by_name(self, sheet_name: str) -> MaterializedSheet:
+        if sheet_name not in self._sheets:
+            raise RuntimeError("No sheet named <{}>".format(sheet_name))
+        return self._sheets[sheet_name]
+
+    def sheet_by_index(self, sheet_idx: int) -> MaterializedSheet:
+        return self._sheets[self._sheet_names[sheet_idx]]
+
+
+class WorkbookCache:
+    """
+    A process wide, size bounded LRU cache of parsed read-only workbooks, shared by every ExcelUtils created with
+    use_cache=True. Files are keyed by their path, modification time and size, so a file that changes on disk is
+    parsed again; byte streams are keyed by a hash of their content. Cached workbooks are fully loaded and never
+    modified afterwards, so concurrent readers can share them
+    """
+
+    def __init__(self, max_size: int = 16):
+        """
+        :param max_size: how many workbooks to keep. The least recently used one is dropped past that
+        """
+        self.max_size = max_size
+        self._books = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock held while that workbook is parsed
+
+    def get(self, path: str = None, raw_file=None):
+        """
+        Gets the parsed workbook for a path or a raw file (bytes or a binary file-like object), parsing it if it is
+        not cached yet
+
+        :return: an xlrd Book for .xls files or a MaterializedBook for .xlsx ones
+        """
+        key = self._key(path, raw_file)
+        with self._lock:
+            book = self._books.get(key)
+            if book is not None:
+                self._books.move_to_end(key)
+                return book
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        # only readers of this same workbook wait for the parse, everything else is still served meanwhile
+        with load_lock:
+            with self._lock:
+                book = self._books.get(key)
+            if book is None:
+                try:
+                    book = self._load(path, raw_file)
+                    with self._lock:
+                        if key[0] == 'path':  # drop older versions of a file that changed on disk
+                            for stale_key in [k for k in self._books if k[:2] == key[:2]]:
+                                del self._books[stale_key]
+                        self._books[key] = book
+                        self._books.move_to_end(key)
+                        while len(self._books) > self.max_size:
+                            self._books.popitem(last=False)
+                finally:
+                    # also when the parse fails, or every bad upload would leave its lock behind
+                    with self._lock:
+                        if self._loading.get(key) is load_lock:
+                            del self._loading[key]
+        return book
+
+    def clear(self):
+        with self._lock:
+            self._books.clear()
+
+    def __len__(self):
+        return len(self._books)
+
+    @staticmethod
+    def _key(path: str = None, raw_file=None) -> tuple:
+        if path:
+            stat = os.stat(path)
+            return 'path', os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+        if isinstance(raw_file, (bytes, bytearray)):
+            content = raw_file
+        else:
+            position = raw_file.tell()
+            content = raw_file.read()
+            raw_file.seek(position)
+        return 'content', hashlib.sha1(content).hexdigest()
+
+    @staticmethod
+    def _load(path: str = None, raw_file=None):
+        import xlrd
+        if XlsxStreamingBook.is_xlsx(path=path, raw_file=raw_file):
+            if isinstance(raw_file, (bytes, bytearray)):
+                raw_file = io.BytesIO(raw_file)
+            return MaterializedBook(XlsxStreamingBook(path or raw_file))
+        if path:
+            return xlrd.open_workbook(filename=path)
+        if not isinstance(raw_file, (bytes, bytearray)):
+            position = raw_file.tell()
+            content = raw_file.read()
+            raw_file.seek(position)
+            raw_file = content
+        return xlrd.open_workbook(file_contents=raw_file)
+
+
+WORKBOOK_CACHE = WorkbookCache()
+
+
 class ExcelUtils:
     """
     Excel file utilities to read a workbook and write to a workbook
     """
-    def __init__(self):
+    extension = 'xlsx'
+
+    def __init__(self, use_cache: bool = False):
+        """
+        :param use_cache: read workbooks through the shared WORKBOOK_CACHE, so a workbook read by many instances is
+            only parsed once per process. Meant for reference files that are read over and over
+        """
+        self.use_cache = use_cache
+        self._cached = False
         self.workbook = None
         self.current_sheet = None
         self.path_or_bytes_stream = None
         self._offset = 0
+        self._indexes = {}
+        self._mmap = None
+        self._formats = {}  # Formatter.key() -> the xlsxwriter Format made for it
+        self._target = None  # where create_new writes to; path_or_bytes_stream is also set by reads
+        self.instrumentation = None  # an Instrumentation to time add_format and instruction resolution
 
     def read_file(self, path: str = None, raw_file=None, sheet: str = None) -> int:
         """
@@ -350,6 +829,7 @@ class ExcelUtils:
         choose the first valid sheet it finds in the workbook
         :param raw_file: The excel file itself (usually as bytes) -- this will allow xlrd to read a
             file from memory instead of reading it from a path on the system. No need to save a file in this case...
+            Real files (anything with a fileno, like a django temporary upload) are memory-mapped instead of copied
         :return: the number of rows found in the current sheet
         """
         if path and raw_file:
@@ -357,26 +837,72 @@ class ExcelUtils:
                                  "instead".format(path))
         if path:
             if self.workbook is None:  # no need to waste time opening it again if it's already in memory
-                self.workbook = xlrd.open_workbook(filename=path)
+                self.workbook = self._read_book(path=path)
                 self.path_or_bytes_stream = path
+                self._indexes = {}
         elif raw_file:
             if self.workbook is None:
-                self.workbook = xlrd.open_workbook(file_contents=raw_file.read())
+                self.workbook = self._read_book(raw_file=raw_file)
                 self.path_or_bytes_stream = raw_file
+                self._indexes = {}
         else:
             raise RuntimeError("No path or raw file provided to read an excel file...what do you want me to do?")
 
-        if sheet:
-            self.current_sheet = self.workbook.sheet_by_name(sheet)
-        else:
-            self.current_sheet = self.workbook.sheet_by_index(0)
+        self.current_sheet = self._switch_sheet(sheet)
         return self.current_sheet.nrows
 
-    def create_new(self, path: str, values, overwrite: bool = False, sheet_name: str = 'Sheet1',
-                   separate_headers: list = None, instructions: dict = None):
+    def _read_book(self, path: str = None, raw_file=None):
+        self._cached = self.use_cache
+        if self.use_cache:
+            return WORKBOOK_CACHE.get(path=path, raw_file=raw_file)
+        return self._open_book(path=path, raw_file=raw_file)
+
+    def _open_book(self, path: str = None, raw_file=None):
+        """
+        Opens a workbook for reading. .xlsx workbooks are streamed through XlsxStreamingBook and .xls ones go
+        through xlrd. Sheets are only loaded when they are first used (xlrd's on_demand) and files are memory-mapped
+        rather than read into a copy
+        """
+        if XlsxStreamingBook.is_xlsx(path=path, raw_file=raw_file):
+            if path:
+                return XlsxStreamingBook(path)
+            if isinstance(raw_file, (bytes, bytearray)):
+                raw_file = io.BytesIO(raw_file)
+            return XlsxStreamingBook(raw_file)
+        import xlrd
+        if path:
+            return xlrd.open_workbook(filename=path, on_demand=True, use_mmap=True)
+        if isinstance(raw_file, (bytes, bytearray)):
+            return xlrd.open_workbook(file_contents=raw_file, on_demand=True)
+        try:
+            fileno = raw_file.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fileno = None
+        if fileno is not None:
+            self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+            return xlrd.open_workbook(file_contents=self._mmap, on_demand=True)
+        return xlrd.open_workbook(file_contents=raw_file.read(), on_demand=True)
+
+    def _switch_sheet(self, sheet: str = None):
+        """
+        Gets a sheet of the open workbook by name (or the first sheet) and unloads the previous current sheet if it
+        is a different one, so only the sheet in use is kept in memory
+        """
+        new_sheet = self.workbook.sheet_by_name(sheet) if sheet else self.workbook.sheet_by_index(0)
+        previous = self.current_sheet
+        if previous is not None and previous is not new_sheet and not self._cached \
+                and hasattr(self.workbook, 'unload_sheet'):
+            self.workbook.unload_sheet(previous.name)
+        return new_sheet
+
+    def create_new(self, path: Union[str, BinaryIO, None], values, overwrite: bool = False,
+                   sheet_name: str = 'Sheet1', separate_headers: list = None, instructions: dict = None,
+                   constant_memory: bool = False):
         """
         Writes to a new excel file at a given path
-        :param path: the path to the new excel file
+        :param path: the path to the new excel file. This can also be a file-like object (a BytesIO for instance),
+            or None to build the workbook in a new BytesIO. Either way nothing touches the disk and the finished
+            workbook bytes are returned by close_workbook
         :param values: a list of lists -- the outer list is the rows and each sublist is the values for the
         respective column indices
         :type values: list[list]
@@ -386,27 +912,40 @@ class ExcelUtils:
             headers will be written before any of the values
         :param instructions: a set of formatting instructions for the row(s) to be written. These can be row
             by row instructions, or column by column instruction or cell by cell instruction
+        :param constant_memory: flush every row to disk as soon as the next row is started, so memory stays flat
+            however many rows are written. Rows must then be written in order, a cell written to an earlier row is
+            lost. Only applies to a path; a file-like target is always built in memory
         :return: the offset - the next row index available for writing
         """
-        if os.path.exists(path):
+        if path is None:
+            path = io.BytesIO()
+        if isinstance(path, str) and os.path.exists(path):
             if not overwrite:
                 msg = "File at path {} already exists. Please explicitly say " \
                       "you with to override this file".format(path)
                 print(msg)
                 raise RuntimeError(msg)
         if not self.workbook:
+            import xlsxwriter
             self.path = path
-            self.workbook = xlsxwriter.Workbook(path)
+            # in_memory keeps xlsxwriter from assembling the workbook through temp files
+            if isinstance(path, str):
+                options = {'constant_memory': True} if constant_memory else {}
+            else:
+                options = {'in_memory': True}
+            self.workbook = xlsxwriter.Workbook(path, options)
+            self._formats = {}
+            self._target = path
         if not self.current_sheet:
             self.current_sheet = self.workbook.add_worksheet(sheet_name)
         if separate_headers:
             for idx, header in enumerate(separate_headers):
-                formatter = self._convert_instructions_to_formats(instructions, 0, idx)
+                formatter = self._formatter_for(instructions, 0, idx)
                 self.write_cell(0, idx, header, formatter)
 
         offset = 1 if separate_headers else 0
 
-        if isinstance(values, QuerySet):
+        if _is_queryset(values):
             count = values.count()
             print("Detected query set with count {} for file {}".format(count, path))
         else:
@@ -417,7 +956,7 @@ class ExcelUtils:
             if isinstance(row, list) or isinstance(row, tuple):
                 for col_idx in range(len(row)):
                     value = DBUtility.serialize(row[col_idx])
-                    formatter = self._convert_instructions_to_formats(instructions, row_idx + offset, col_idx)
+                    formatter = self._formatter_for(instructions, row_idx + offset, col_idx)
                     self.write_cell(row_idx + offset, col_idx, value, formatter)
             elif isinstance(row, dict):
                 pass
@@ -444,11 +983,11 @@ class ExcelUtils:
 
         if separate_headers:
             for idx, header in enumerate(separate_headers):
-                formatter = self._convert_instructions_to_formats(instructions, 0, idx)
+                formatter = self._formatter_for(instructions, 0, idx)
                 self.write_cell(0, idx, header, formatter)
 
         offset = 1 if separate_headers else 0
-        if isinstance(values, QuerySet):
+        if _is_queryset(values):
             count = values.count()
             print("Detected query set with count {} for file {}".format(count, self.path_or_bytes_stream))
         else:
@@ -459,7 +998,7 @@ class ExcelUtils:
             if isinstance(row, list) or isinstance(row, tuple):
                 for col_idx in range(len(row)):
                     value = DBUtility.serialize(row[col_idx])
-                    formatter = self._convert_instructions_to_formats(instructions, row_idx+offset, col_idx)
+                    formatter = self._formatter_for(instructions, row_idx+offset, col_idx)
                     self.write_cell(row_idx + offset, col_idx, value, formatter)
             elif isinstance(row, dict):
                 pass
@@ -480,18 +1019,30 @@ class ExcelUtils:
 
         :return: a list of lists which are all the rows in the excel
         """
-        values = []
+        # like before, a given row_end reads the current sheet and only a full read switches to sheet_name
+        if self.current_sheet is None or (row_end is None and self.current_sheet.name != sheet_name):
+            self.current_sheet = self._switch_sheet(sheet_name)
+        sheet = self.current_sheet
         if row_end is None:
-            row_end = self.read_file(path=self.path_or_bytes_stream, sheet=sheet_name) - 1  # -1 because of 0 indexing
-        for i in range(row_start, row_end + 1):
-            row_val = self.row_values(row_idx=i, start_idx=col_start, end_idx=col_end)
-            values.append(row_val)
-        return values
+            row_end = sheet.nrows - 1  # -1 because of 0 indexing
+        row_values = sheet.row_values
+        return [row_values(i, col_start, col_end) for i in range(row_start, row_end + 1)]
 
     # new method added
     def write_cell(self, row_idx:int, col_idx: int, value:str, formatter:Formatter):
-        cell_format = self.workbook.add_format()
-        formatter.set_format(cell_format) # set format
+        # one Format per distinct formatter, instead of one per cell that xlsxwriter would keep until the end
+        format_key = formatter.key()
+        cell_format = self._formats.get(format_key)
+        if cell_format is None:
+            if self.instrumentation is None:
+                cell_format = self.workbook.add_format()
+            else:
+                cell_format = self.instrumentation.call('add_format', self.workbook.add_format)
+                self.instrumentation.count('formats_created')
+            formatter.set_format(cell_format) # set format
+            self._formats[format_key] = cell_format
+        if self.instrumentation is not None:
+            self.instrumentation.count('cells_written')
         self.current_sheet.write(row_idx, col_idx, value, cell_format)
 
 
@@ -515,13 +1066,13 @@ class ExcelUtils:
             for row_idx, row in enumerate(values):
                 for col_idx, item in enumerate(row):
                     value = DBUtility.serialize(item)
-                    formatter = self._convert_instructions_to_formats(instructions, row_idx, col_idx)
+                    formatter = self._formatter_for(instructions, row_idx, col_idx)
                     self.write_cell(row_idx + offset, col_idx, value, formatter)
                 new_offset += 1
         elif is_nested == False:
             for col_idx, item in enumerate(values):
                 value = DBUtility.serialize(item)
-                formatter = self._convert_instructions_to_formats(instructions, offset, col_idx)
+                formatter = self._formatter_for(instructions, offset, col_idx)
                 self.write_cell(offset, col_idx, value, formatter)
             new_offset += 1
         self._offset = new_offset
@@ -530,7 +1081,8 @@ class ExcelUtils:
     def get_rows(self, filters: list = None, grab_headers: bool = False, sanitize_dates=None):
         """
         Gets all the rows in an excel sheet and can even filter the rows based on specific values. These
-        filters must be a list of equality checks (for now)
+        filters must be a list of equality checks (for now). Use iter_rows to stream the rows or for any other kind
+        of filter
 
         :param grab_headers: whether to return the column headers as part of the rows
         :param filters: must be an ordered list of filters to apply
@@ -540,37 +1092,162 @@ class ExcelUtils:
 
         :return: a list of rows with filters applied
         """
-        rows = []
-        if grab_headers and not filters:
-            # it means we should return all the rows
-            rows = self.current_sheet.get_rows()
+        predicates = dict(enumerate(filters)) if filters else None
+        return list(self.iter_rows(predicates=predicates, grab_headers=grab_headers, sanitize_dates=sanitize_dates))
+
+    def iter_rows(self, predicates: dict = None, columns: List[int] = None, grab_headers: bool = False,
+                  sanitize_dates=None):
+        """
+        Lazily yields the rows of the current sheet which satisfy every predicate. The predicate cells are checked
+        before anything else is read and a row is dropped on the first predicate it misses, so filtering a big sheet
+        only reads the cells it needs and never holds more than one row. A predicate can be:
+        {
+            0: 'Active',                       # equality
+            2: {'Lookup', 'Copy'},             # set membership
+            4: ValueRange(low=10, high=20),    # range (either end can be left open)
+            5: lambda value: value != '',      # any callable taking the cell value
+        }
+
+        :param predicates: a dictionary of column index to predicate
+        :param columns: the column indices to return, in that order. All the columns are returned if this is not given
+        :param grab_headers: whether to start at the header row
+        :param sanitize_dates: the indices of columns whose values must be converted to python datetime objects
+        :type sanitize_dates: list[int]
+
+        :return: a generator of the (projected) rows as lists
+        """
+        sheet = self.current_sheet
+        checks = self._compile_predicates(predicates)
         start = 0 if grab_headers else 1
-        for row_num in range(start, self.current_sheet.nrows):
-            row = self.current_sheet.row(row_num)  # type: list[xlrd.sheet.Cell]
-            row_values = []
-            disregard = False
-            for cell_idx in range(len(row)):
-                cell_val = row[cell_idx].value
-                if filters:
-                    for filter_idx in range(len(filters)):
-                        if filter_idx == cell_idx:  # if the columns align, check the value
-                            if cell_val != filters[filter_idx]:
-                                disregard = True
-                if not disregard:
-                    if sanitize_dates and cell_idx in sanitize_dates:
-                        if cell_val is not None and (isinstance(cell_val, int) or isinstance(cell_val, float)):
-                            cell_val = xldate_as_datetime(cell_val, self.workbook.datemode)
-                        elif cell_val is None or cell_val == '':
-                            cell_val = None
-                        elif isinstance(cell_val, str):
-                            is_datetime, cell_val = self.is_datetime(cell_val)
-                        else:
-                            raise RuntimeError("Expected a Date field in column {}. Got {} value "
-                                               "instead".format(cell_idx + 1, cell_val))
-                    row_values.append(cell_val)
-            if row_values and not disregard:
-                rows.append(row_values)
-        return rows
+        date_parsers = self._date_parsers(sanitize_dates, start) if sanitize_dates else None
+        for row_num in range(start, sheet.nrows):
+            row_len = sheet.row_len(row_num)
+            matched = True
+            for col_idx, check in checks:
+                # like get_rows always did, filters past the end of a row do not apply to it
+                if col_idx < row_len and not check(sheet.cell_value(row_num, col_idx)):
+                    matched = False
+                    break
+            if not matched:
+                continue
+            if columns is None:
+                row_values = sheet.row_values(row_num)
+                col_indices = range(len(row_values))
+            else:
+                row_values = [sheet.cell_value(row_num, col_idx) if col_idx < row_len else ''
+                              for col_idx in columns]
+                col_indices = columns
+            if not row_values:
+                continue
+            if date_parsers:
+                for position, cell_idx in enumerate(col_indices):
+                    if cell_idx in date_parsers:
+                        row_values[position] = date_parsers[cell_idx].parse(row_values[position])
+            yield row_values
+
+    def _date_parsers(self, sanitize_dates, start: int) -> Dict[int, DateColumnParser]:
+        """
+        Makes a DateColumnParser for every date column, with its format inferred from the first string values. The
+        columns are sampled together in one pass over at most DateColumnParser.SAMPLE_ROWS rows
+        """
+        sheet = self.current_sheet
+        parsers = {col_idx: DateColumnParser(self.workbook.datemode, col_idx) for col_idx in sanitize_dates}
+        samples = {col_idx: [] for col_idx in parsers}
+        sampling = set(parsers)
+        for row_num in range(start, min(sheet.nrows, start + DateColumnParser.SAMPLE_ROWS)):
+            if not sampling:
+                break
+            row = sheet.row_values(row_num)
+            for col_idx in list(sampling):
+                if col_idx < len(row):
+                    value = row[col_idx]
+                    if isinstance(value, str) and value != '':
+                        samples[col_idx].append(value)
+                        if len(samples[col_idx]) >= DateColumnParser.SAMPLE_SIZE:
+                            sampling.discard(col_idx)
+        for col_idx, parser in parsers.items():
+            parser.infer_format(samples[col_idx])
+        return parsers
+
+    @staticmethod
+    def _compile_predicates(predicates: dict) -> list:
+        """
+        Turns the predicates given to iter_rows into a list of (column index, check function). Equality checks are
+        the cheapest so they go first, then membership and range checks, then custom callables
+        """
+        if not predicates:
+            return []
+        checks = []
+        for col_idx, predicate in predicates.items():
+            if callable(predicate) and not isinstance(predicate, ValueRange):
+                checks.append((2, col_idx, predicate))
+            elif isinstance(predicate, (set, frozenset, ValueRange)):
+                checks.append((1, col_idx, predicate.__contains__))
+            else:
+                checks.append((0, col_idx, functools.partial(operator.eq, predicate)))
+        checks.sort(key=lambda check: check[0])
+        return [(col_idx, check) for _, col_idx, check in checks]
+
+    def build_index(self, columns: Union[int, List[int]], grab_headers: bool = False) -> Dict:
+        """
+        Builds a hash index of the current sheet on one or more columns so rows can be looked up by key without
+        scanning the sheet. The index is built on the first call and cached per sheet and columns; it is dropped
+        when the workbook is closed or another workbook is read. For a streamed .xlsx sheet the rows are kept in memory
+        along with the index, since the sheet can't be read at random
+
+        :param columns: the column index to key on, or a list of column indices for a compound key
+        :param grab_headers: whether the header row is indexed as well
+        :return: a dictionary of key to the list of row numbers which have that key. Compound keys are tuples
+        """
+        compound = not isinstance(columns, int)
+        key_columns = tuple(columns) if compound else (columns,)
+        cache_key = (self.current_sheet.name, key_columns, compound, grab_headers)
+        index = self._indexes.get(cache_key)
+        if index is not None:
+            return index
+
+        index = {}
+        sheet = self.current_sheet
+        start = 0 if grab_headers else 1
+        if isinstance(sheet, XlsxStreamingSheet):
+            # a streaming sheet can only be read forward, so jumping back to a looked up row would re-parse the
+            # sheet from the top. The rows are kept while the index is built and lookup reads them from here
+            rows = self._indexes.setdefault(('rows', sheet.name), {})
+            for row_num in range(start, sheet.nrows):
+                row = rows.get(row_num)
+                if row is None:
+                    row = rows[row_num] = sheet.row_values(row_num)
+                key = tuple(row[col_idx] if col_idx < len(row) else '' for col_idx in key_columns)
+                index.setdefault(key if compound else key[0], []).append(row_num)
+        else:
+            for row_num in range(start, sheet.nrows):
+                row_len = sheet.row_len(row_num)
+                key = tuple(sheet.cell_value(row_num, col_idx) if col_idx < row_len else ''
+                            for col_idx in key_columns)
+                index.setdefault(key if compound else key[0], []).append(row_num)
+        self._indexes[cache_key] = index
+        return index
+
+    def lookup(self, key, columns: Union[int, List[int]], projection: List[int] = None) -> List[list]:
+        """
+        Gets the rows of the current sheet whose column(s) equal a key, using the index from build_index (which is
+        built on the first lookup against those columns)
+
+        :param key: the value to look for. For a compound index this is a tuple with one value per column
+        :param columns: the column index, or list of column indices, the key is made of
+        :param projection: the column indices to return. All the columns are returned if this is not given
+        :return: a list of the matching rows
+        """
+        row_nums = self.build_index(columns).get(key, [])
+        sheet = self.current_sheet
+        rows = self._indexes.get(('rows', sheet.name))
+        if rows is not None:
+            if projection is None:
+                return [list(rows[row_num]) for row_num in row_nums]
+            return [[rows[row_num][col_idx] for col_idx in projection] for row_num in row_nums]
+        if projection is None:
+            return [sheet.row_values(row_num) for row_num in row_nums]
+        return [[sheet.cell_value(row_num, col_idx) for col_idx in projection] for row_num in row_nums]
 
     def get_uploaded_file_columns(self, path: str, overwrite: bool = True):
         """
@@ -587,14 +1264,19 @@ class ExcelUtils:
                 print(msg)
                 raise RuntimeError(msg)
 
-        book = xlrd.open_workbook(path)
-        budget_sheet = book.sheet_by_index(0)
-        column_headers = budget_sheet.row_values(0)
+        if self.workbook is not None and self.path_or_bytes_stream == path:
+            return self.workbook.sheet_by_index(0).row_values(0)
+        # only the first sheet gets loaded (only its first row for .xlsx) and the file is mapped rather than read
+        book = self._open_book(path=path)
+        try:
+            column_headers = book.sheet_by_index(0).row_values(0)
+        finally:
+            book.release_resources()
         return column_headers
 
     def row_values(self, row_idx: int = 0, start_idx: int = 0, end_idx: int = None, sheet: Union[str, int] = None):
         """
-        Wrapper around the xlrd's row_values method. Returns the values in the first row of an excel file.
+        Wrapper around the sheet's row_values method. Returns the values in the first row of an excel file.
         if no idx is provided, it will default to 0. By default it uses the current sheet of the open workbook
         of the instance!
 
@@ -613,52 +1295,57 @@ class ExcelUtils:
             raise RuntimeError("Invalid sheet datatype passed into row values. sheet value: {}".format(sheet))
         return xl_sheet.row_values(row_idx, start_idx, end_idx)
 
-    def close_workbook(self):
+    def close_workbook(self) -> Union[bytes, None]:
+        """
+        Closes the open workbook, which is when xlsxwriter actually writes it out
+
+        :return: the finished workbook bytes if create_new wrote it to a BytesIO, otherwise None (always None for a
+            workbook opened for reading)
+        """
         print("Closing workbook {}".format(self.workbook))
         try:
-            self.workbook.close()
+            if self._cached:  # shared with other instances through the cache, so it stays open
+                pass
+            elif hasattr(self.workbook, 'release_resources'):  # a workbook opened for reading
+                self.workbook.release_resources()
+            else:
+                self.workbook.close()
         except Exception as e:
             print('Unable to close workbook. Not stopping execution though. Error: {}'.format(e))
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
         self.workbook = None
         self.current_sheet = None
+        self._indexes = {}
+        self._formats = {}
+        self._cached = False
+        target, self._target = self._target, None
+        if isinstance(target, io.BytesIO):
+            return target.getvalue()
+        return None
 
     @staticmethod
     def is_datetime(param):
-        accepted_formats = [
-            '%Y-%m-%d %H:%M:%SZ',
-            '%m/%d/%Y %H:%M%SZ',
-            '%Y-%m-%d',
-            '%m/%d/%Y',
-            '%m/%d',
-            '%m-%d',
-            '%m/%d/%Y %H:%M',
-            '%m/%d/%Y %I:%M',
-            '%Y-%m-%d %H:%M',
-            '%Y-%m-%d %I:%M'
-        ]
-        bad_formats = [
-            '%m-%Y-%d',
-            '%m-%Y',
-            '%m-%Y-%d %H:%M'
-        ]
-        satisfied_bad = False
-        datetime_obj = None
-        for accepted_format in accepted_formats:
+        for accepted_format in ACCEPTED_DATE_FORMATS:
             try:
-                datetime_obj = datetime.strptime(param, accepted_format)
-                return True, datetime_obj
-            except:
+                return True, datetime.strptime(param, accepted_format)
+            except ValueError:
                 pass
 
-        for bad_format in bad_formats:
+        for bad_format in BAD_DATE_FORMATS:
             try:
                 datetime.strptime(param, bad_format)
-                satisfied_bad = True
-            except:
+                return False, None
+            except ValueError:
                 pass
-        if satisfied_bad:
-            return False, None
-        return True, datetime_obj
+        return True, None
+
+    def _formatter_for(self, instructions: dict, row_idx: int, col_idx: int) -> Union[Formatter, None]:
+        if self.instrumentation is None:
+            return self._convert_instructions_to_formats(instructions, row_idx, col_idx)
+        return self.instrumentation.call('_convert_instructions_to_formats', self._convert_instructions_to_formats,
+                                         instructions, row_idx, col_idx)
 
     @staticmethod
     def _convert_instructions_to_formats(instructions: dict, row_idx: int, col_idx: int) -> Union[Formatter, None]:
@@ -696,6 +1383,7 @@ class ExcelUtils:
         col_idx = str(col_idx)
         cell = (row_idx, col_idx)
 
+        import copy
         instructions_copy = copy.deepcopy(instructions)
 
         if instructions.get('cell') and instructions['cell'].get(cell):
@@ -726,6 +1414,439 @@ class ExcelUtils:
     @property
     def offset(self):
         return self._offset
+
+
+class RowWriter(ABC):
+    """
+    Base class for the non-Excel output writers. They take the same rows as ExcelUtils and expose the same
+    create_new / write_row / close_workbook methods, but skip all the cell formatting. Each row is written out to the
+    target as soon as it is handed over so nothing is buffered until the end of the run
+    """
+    extension = None
+
+    def __init__(self):
+        self.path_or_bytes_stream = None
+        self.headers = None
+        self._offset = 0
+        self.instrumentation = None  # an Instrumentation to count the cells written
+
+    def create_new(self, path: Union[str, BinaryIO, None], values, overwrite: bool = False,
+                   sheet_name: str = 'Sheet1', separate_headers: list = None, instructions: dict = None):
+        """
+        Opens a new output at a given path and writes any rows given
+
+        :param path: the path to the new output file, a binary file-like object, or None to write to a new BytesIO
+        :param values: a list of lists -- the outer list is the rows and each sublist is the values for the
+            respective column indices
+        :param overwrite: whether to overwrite an existing output at a particular path
+        :param sheet_name: the name of the table (where the output format has one)
+        :param separate_headers: the column names of the output. These are written before any of the values
+        :param instructions: formatting instructions. These are accepted for compatibility with ExcelUtils and ignored
+        :return: the offset - the next row index available for writing
+        """
+        if path is None:
+            path = io.BytesIO()
+        if isinstance(path, str) and os.path.exists(path):
+            if not overwrite:
+                msg = "File at path {} already exists. Please explicitly say " \
+                      "you with to override this file".format(path)
+                print(msg)
+                raise RuntimeError(msg)
+        self.headers = list(separate_headers) if separate_headers else None
+        self._open(path, sheet_name)
+        self.path_or_bytes_stream = path
+        self._offset = 1 if separate_headers else 0
+        if values:
+            self.write_row(values)
+        return self._offset
+
+    def write_row(self, values: list, offset: int = None, instructions: dict = None) -> int:
+        """
+        Writes a single row or a list of rows to the output
+
+        :param values: a list of values, or a list of lists of values
+        :param offset: accepted for compatibility with ExcelUtils. Rows are always appended
+        :param instructions: accepted for compatibility with ExcelUtils and ignored
+        :return the next offset
+        """
+        if len(values) == 0:
+            return self._offset
+        if isinstance(values[0], list) or isinstance(values[0], tuple):
+            for row in values:
+                self._write([self._serialize(item) for item in row])
+                self._offset += 1
+                if self.instrumentation is not None:
+                    self.instrumentation.count('cells_written', len(row))
+        else:
+            self._write([self._serialize(item) for item in values])
+            self._offset += 1
+            if self.instrumentation is not None:
+                self.instrumentation.count('cells_written', len(values))
+        return self._offset
+
+    @staticmethod
+    def _serialize(item):
+        return DBUtility.serialize(item)
+
+    def close_workbook(self) -> Union[bytes, None]:
+        """
+        Flushes and closes the output. A file-like target given to create_new is flushed but left open for the caller
+
+        :return: the output bytes if it was written to a BytesIO, otherwise None
+        """
+        print("Closing {} output {}".format(self.extension, self.path_or_bytes_stream))
+        try:
+            self._close()
+        except Exception as e:
+            print('Unable to close output. Not stopping execution though. Error: {}'.format(e))
+        if isinstance(self.path_or_bytes_stream, io.BytesIO):
+            return self.path_or_bytes_stream.getvalue()
+        return None
+
+    @abstractmethod
+    def _open(self, path: Union[str, BinaryIO], sheet_name: str):
+        pass
+
+    @abstractmethod
+    def _write(self, row: list):
+        pass
+
+    @abstractmethod
+    def _close(self):
+        pass
+
+    @staticmethod
+    def _open_text(path: Union[str, BinaryIO], newline: str = None):
+        if isinstance(path, str):
+            return open(path, 'w', newline=newline, encoding='utf-8')
+        return io.TextIOWrapper(path, newline=newline, encoding='utf-8', write_through=True)
+
+    @staticmethod
+    def _close_text(text_file, path: Union[str, BinaryIO]):
+        if isinstance(path, str):
+            text_file.close()
+        else:
+            text_file.flush()
+            text_file.detach()  # the caller owns the stream so it must stay open
+
+    @property
+    def offset(self):
+        return self._offset
+
+
+class CsvWriter(RowWriter):
+    extension = 'csv'
+
+    def _open(self, path: Union[str, BinaryIO], sheet_name: str):
+        self._file = self._open_text(path, newline='')
+        import csv
+        self._writer = csv.writer(self._file)
+        if self.headers:
+            self._writer.writerow(self.headers)
+
+    def _write(self, row: list):
+        self._writer.writerow(row)
+
+    def _close(self):
+        self._close_text(self._file, self.path_or_bytes_stream)
+
+
+class JsonLinesWriter(RowWriter):
+    """
+    Writes one JSON object per row. The keys are the headers, or the column index when no headers were given.
+    Parsed activity details are written as a nested object instead of being rendered to text
+    """
+    extension = 'jsonl'
+
+    @staticmethod
+    def _serialize(item):
+        if isinstance(item, ActivityDetails):
+            return item.to_dict()
+        return DBUtility.serialize(item)
+
+    def _open(self, path: Union[str, BinaryIO], sheet_name: str):
+        self._file = self._open_text(path)
+
+    def _write(self, row: list):
+        keys = self.headers or [str(idx) for idx in range(len(row))]
+        self._file.write(json.dumps(dict(zip(keys, row))))
+        self._file.write('\n')
+
+    def _close(self):
+        self._close_text(self._file, self.path_or_bytes_stream)
+
+
+class SQLiteWriter(RowWriter):
+    """
+    Writes the rows into a table named after the sheet name. Overwriting drops the table, other tables in the
+    database are left alone. SQLite needs a real file so file-like targets are not supported
+    """
+    extension = 'sqlite'
+
+    def _open(self, path: Union[str, BinaryIO], sheet_name: str):
+        if not isinstance(path, str):
+            raise RuntimeError("The SQLite output can only be written to a path on disk")
+        if not self.headers:
+            raise RuntimeError("The SQLite output needs separate_headers to name the table columns")
+        import sqlite3
+        self._connection = sqlite3.connect(path)
+        table = self._quote(sheet_name)
+        columns = ', '.join('{} TEXT'.format(self._quote(header)) for header in self.headers)
+        self._connection.execute('DROP TABLE IF EXISTS {}'.format(table))
+        self._connection.execute('CREATE TABLE {} ({})'.format(table, columns))
+        self._insert = 'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * len(self.headers)))
+
+    def _write(self, row: list):
+        self._connection.execute(self._insert, row)
+
+    def _close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        return '"{}"'.format(str(name).replace('"', '""'))
+
+
+class ParquetWriter(RowWriter):
+    """
+    Writes the rows as string columns to a parquet file. Requires pyarrow; rows are flushed as a row group every
+    `batch_size` rows
+    """
+    extension = 'parquet'
+
+    def __init__(self, batch_size: int = 10000):
+        super().__init__()
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("The parquet output needs pyarrow to be installed")
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.batch_size = batch_size
+
+    def _open(self, path: Union[str, BinaryIO], sheet_name: str):
+        if not self.headers:
+            raise RuntimeError("The parquet output needs separate_headers to name the columns")
+        self._schema = self._pa.schema([(str(header), self._pa.string()) for header in self.headers])
+        self._writer = self._pq.ParquetWriter(path, self._schema)
+        self._batch = []
+
+    def _write(self, row: list):
+        self._batch.append(row)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        columns = [[None if row[idx] is None else str(row[idx]) for row in self._batch]
+                   for idx in range(len(self.headers))]
+        self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self._schema))
+        self._batch = []
+
+    def _close(self):
+        self._flush()
+        self._writer.close()
+
+
+OUTPUT_WRITERS = {
+    'xlsx': ExcelUtils,
+    'csv': CsvWriter,
+    'jsonl': JsonLinesWriter,
+    'sqlite': SQLiteWriter,
+    'parquet': ParquetWriter,
+}
+
+
+class ActivityDetails(ABC):
+    """
+    Structured result of a Parse* class. The parsers only pick the values out of the activity json; the text that
+    ends up in the Details cell is built by render(), and only when an output actually needs it. Structured outputs
+    use to_dict() instead and never build the string
+    """
+    __slots__ = ()
+    kind = None
+
+    @abstractmethod
+    def render(self) -> str:
+        pass
+
+    def to_dict(self) -> dict:
+        values = {'kind': self.kind}
+        for slot in self.__slots__:
+            values[slot] = getattr(self, slot)
+        return values
+
+    def __str__(self):
+        return self.render()
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.to_dict())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __hash__(self):
+        # consistent with __eq__: dicts compare equal in any order, so they are hashed as frozensets
+        return hash((type(self), self._freeze(self.to_dict())))
+
+    @classmethod
+    def _freeze(cls, value):
+        if isinstance(value, dict):
+            return frozenset((key, cls._freeze(item)) for key, item in value.items())
+        if isinstance(value, (list, tuple)):
+            return tuple(cls._freeze(item) for item in value)
+        return value
+
+    @staticmethod
+    def _render_parameters(parameters: Dict[str, str], separator: str) -> str:
+        return ','.join(name + separator + value for name, value in parameters.items())
+
+
+class LookupDetails(ActivityDetails):
+    __slots__ = ('sproc_name', 'parameters')
+    kind = 'Lookup'
+
+    def __init__(self, sproc_name: str, parameters: Dict[str, str]):
+        self.sproc_name = sproc_name
+        self.parameters = parameters
+
+    def render(self) -> str:
+        return '{} ,    Parameters: {}'.format(self.sproc_name, self._render_parameters(self.parameters, ': '))
+
+
+class IfConditionDetails(ActivityDetails):
+    __slots__ = ('expression',)
+    kind = 'IfCondition'
+
+    def __init__(self, expression: str):
+        self.expression = expression
+
+    def render(self) -> str:
+        return 'Expression:     {}'.format(self.expression)
+
+
+class StoredProcedureDetails(ActivityDetails):
+    __slots__ = ('sproc_name', 'parameters')
+    kind = 'SqlServerStoredProcedure'
+
+    def __init__(self, sproc_name: str, parameters: Dict[str, str]):
+        self.sproc_name = sproc_name
+        self.parameters = parameters
+
+    def render(self) -> str:
+        return 'Stored procedure name {0} ,    Parameters: {1}'.format(self.sproc_name,
+                                                                       self._render_parameters(self.parameters, ': '))
+
+
+class WebActivityDetails(ActivityDetails):
+    __slots__ = ('url', 'method', 'content_type', 'body')
+    kind = 'WebActivity'
+
+    def __init__(self, url: str, method: str, content_type: str, body):
+        self.url = url
+        self.method = method
+        self.content_type = content_type
+        self.body = body
+
+    def render(self) -> str:
+        return 'Http request URL: {0} \n\n Method Name : {1} \n\n Body properties : {2}'.format(self.url, self.method,
+                                                                                               self.body)
+
+
+class WaitDetails(ActivityDetails):
+    __slots__ = ('wait_time_in_seconds',)
+    kind = 'Wait'
+
+    def __init__(self, wait_time_in_seconds):
+        self.wait_time_in_seconds = wait_time_in_seconds
+
+    def render(self) -> str:
+        return 'Wait time in Seconds:  {}'.format(self.wait_time_in_seconds)
+
+
+class DeleteDetails(ActivityDetails):
+    __slots__ = ('dataset', 'wildcard_file_name')
+    kind = 'Delete'
+
+    def __init__(self, dataset: str, wildcard_file_name: str):
+        self.dataset = dataset
+        self.wildcard_file_name = wildcard_file_name
+
+    def render(self) -> str:
+        return 'DataSet name-{0} \nFileName-{1}'.format(self.dataset, self.wildcard_file_name)
+
+
+class ExecutePipelineDetails(ActivityDetails):
+    __slots__ = ('pipeline',)
+    kind = 'ExecutePipeline'
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+
+    def render(self) -> str:
+        return 'Child pipeline Name : {}'.format(self.pipeline)
+
+
+class CopyDetails(ActivityDetails):
+    __slots__ = ('input_dataset', 'output_dataset', 'source', 'folder_path')
+    kind = 'Copy'
+
+    def __init__(self, input_dataset: str, output_dataset: str, source: str, folder_path: str):
+        self.input_dataset = input_dataset
+        self.output_dataset = output_dataset
+        self.source = source
+        self.folder_path = folder_path
+
+    def render(self) -> str:
+        return 'Input DataSet : {0} \nOutput DataSet : {1}\n File name : {2}\nFolder Name or Path:{3}'.format(
+            self.input_dataset, self.output_dataset, self.source, self.folder_path)
+
+
+class NotebookDetails(ActivityDetails):
+    __slots__ = ('notebook_path', 'parameters')
+    kind = 'DatabricksNotebook'
+
+    def __init__(self, notebook_path: str, parameters: Dict[str, str]):
+        self.notebook_path = notebook_path
+        self.parameters = parameters
+
+    def render(self) -> str:
+        param = ''.join(name + ' : ' + value + ',\n' for name, value in self.parameters.items())
+        return 'Notebook path: {0} \n\n Paramerters: {1}'.format(self.notebook_path, param)
+
+
+class GetMetadataDetails(ActivityDetails):
+    __slots__ = ('dataset', 'field_list')
+    kind = 'GetMetadata'
+
+    def __init__(self, dataset: str, field_list: List[str]):
+        self.dataset = dataset
+        self.field_list = field_list
+
+    def render(self) -> str:
+        attr = ''.join(str(field) + ' , ' for field in self.field_list)
+        return 'Dataset name: {0} \n\n Metadata attributes: {1}'.format(self.dataset, attr)
+
+
+def _parameter_values(param_obj, nested: bool = True) -> Dict[str, str]:
+    """
+    Flattens a stored procedure / notebook parameter object to {name: value} strings. Stored procedure parameters
+    are {name: {"value": ...}} while notebook parameters are {name: value}. Expressions are {"value": ...} in both
+    """
+    param_details = {}
+    for param in param_obj or {}:
+        val = param_obj.get(param)
+        if nested and type(val) is dict:
+            val = val.get('value')
+        if type(val) is dict:
+            val = val.get('value')
+        param_details[param] = str(val)
+    return param_details
+
+
 class ParseLookup:
     def parse(self, input_data):
         typeProperties = input_data.get('typeProperties','')
@@ -733,17 +1854,7 @@ class ParseLookup:
             source = typeProperties.get('source', '')
             if source:
                 sproc_name = source.get('sqlReaderStoredProcedureName', '')
-                param_details = []
-                param_obj = source.get('storedProcedureParameters', '')
-                for param in param_obj:
-                    val = param_obj.get(param).get('value')
-                    if type(val) is dict:
-                        val = str(val.get('value'))
-                    else:
-                        val = str(val)
-                    param_details.append(param + ': ' + val)
-
-                return '{} ,    Parameters: {}'.format(sproc_name, ','.join(param_details))
+                return LookupDetails(sproc_name, _parameter_values(source.get('storedProcedureParameters', '')))
 
 class ParseIfCondition:
     def parse(self, input_data):
@@ -751,25 +1862,15 @@ class ParseIfCondition:
         if typeProperties:
             expression = typeProperties.get('expression', '')
             if expression:
-                exp_val = expression.get('value','')
-                return 'Expression:     {}'.format(exp_val)
+                return IfConditionDetails(expression.get('value',''))
 
 class ParseSPROC:
     def parse(self, input_data):
         typeProperties = input_data.get('typeProperties','')
         if typeProperties:
             sproc_name = typeProperties.get('storedProcedureName', '')
-            param_details = []
-            param_obj = typeProperties.get('storedProcedureParameters', '')
-            for param in param_obj:
-                val = param_obj.get(param).get('value')
-                if type(val) is dict:
-                    val = str(val.get('value'))
-                else:
-                    val = str(val)
-                param_details.append(param + ': ' + val)
-
-            return 'Stored procedure name {0} ,    Parameters: {1}'.format(sproc_name, ','.join(param_details))
+            return StoredProcedureDetails(sproc_name,
+                                          _parameter_values(typeProperties.get('storedProcedureParameters', '')))
 
 class ParseWebActivity:
     def parse(self, input_data):
@@ -778,33 +1879,25 @@ class ParseWebActivity:
             url_name = typeProperties.get('url', '')
             method_name = typeProperties.get('method', '')
             header_name = typeProperties.get('header', '')
-            if header_name:
-                        content = header_name.get('Content-Type','')
-                        print(content)
+            content = header_name.get('Content-Type', '') if header_name else ''
             Body_properties = typeProperties.get('body', '')
-
-
-        return 'Http request URL: {0} \n\n Method Name : {1} \n\n Body properties : {2}'.format(url_name,method_name,Body_properties)
+            return WebActivityDetails(url_name, method_name, content, Body_properties)
 
 class ParseWaitActivity:
     def parse(self, input_data):
         typeProperties = input_data.get('typeProperties', '')
         if typeProperties:
-           wait_val = typeProperties.get('waitTimeInSeconds','')
-           return 'Wait time in Seconds:  {}'.format(wait_val)
+           return WaitDetails(typeProperties.get('waitTimeInSeconds',''))
 
 class ParseDeleteActivity:
     def parse(self, input_data):
-        global val
         typeProperties = input_data.get('typeProperties', '')
         if typeProperties:
-            dataset_name = typeProperties.get('dataset','')
+            dataset_name = typeProperties.get('dataset') or {}
             reference_Name = dataset_name.get('referenceName','')
             store_settings = typeProperties.get('storeSettings','')
             if store_settings:
-                wildcardFileName = store_settings.get('wildcardFileName','')
-
-                return 'DataSet name-{0} \nFileName-{1}'.format(reference_Name,wildcardFileName)
+                return DeleteDetails(reference_Name, store_settings.get('wildcardFileName',''))
 
 class ParseExecutePipeline:
     def parse(self, input_data):
@@ -812,12 +1905,12 @@ class ParseExecutePipeline:
         if typeProperties:
             pipeline = typeProperties.get('pipeline', '')
             if pipeline:
-                ref = pipeline.get('referenceName','')
-                return 'Child pipeline Name : {}'.format(ref)
+                return ExecutePipelineDetails(pipeline.get('referenceName',''))
 
 class ParseCopyActivity:
     def parse(self, input_data):
         typeProperties = input_data.get('typeProperties', '')
+        inputreferenceName = outputreferenceName = ''
 
         if input_data.get('inputs', ''):
             inputs = input_data.get('inputs', '')
@@ -837,53 +1930,28 @@ class ParseCopyActivity:
                         if storeSettings.get('wildcardFileName', ''):
                             v_source = storeSettings.get('wildcardFileName', '')
                             v_foldername = storeSettings.get('wildcardFolderPath', '')
-
-                            return 'Input DataSet : {0} \nOutput DataSet : {1}\n File name : {2}\nFolder Name or Path:{3}'.format(
-                                inputreferenceName, outputreferenceName, v_source, v_foldername)
+                            return CopyDetails(inputreferenceName, outputreferenceName, v_source, v_foldername)
 
                 if type == 'SqlDWSource':
                     if source.get('sqlReaderStoredProcedureName', ''):
                         v_source = source.get('sqlReaderStoredProcedureName', '')
-                        v_foldername = ''
-
-                        return 'Input DataSet : {0} \nOutput DataSet : {1}\n File name : {2}\nFolder Name or Path:{3}'.format(
-                            inputreferenceName, outputreferenceName, v_source, v_foldername)
+                        return CopyDetails(inputreferenceName, outputreferenceName, v_source, '')
 
 class ParseNotebookActivity:
     def parse(self, input_data):
         typeProperties = input_data.get('typeProperties', '')
         if typeProperties:
             notebook_path = typeProperties.get('notebookPath', '')
-            param_details = []
-            param_obj = typeProperties.get('baseParameters', '')
-            for param in param_obj:
-                val = param_obj.get(param)  # .get('value')
-                if type(val) is dict:
-                    val = str(val.get('value'))
-                    val = param + ' : ' + val
-                else:
-                    val = str(param + ' : ' + val)
-                param_details.append(val)
-
-            param = ""
-
-            for i in param_details:
-                param = i + ',\n' + param
-
-
-        return 'Notebook path: {0} \n\n Paramerters: {1}'.format(notebook_path,param)
+            return NotebookDetails(notebook_path, _parameter_values(typeProperties.get('baseParameters', ''),
+                                                                    nested=False))
 
 class ParseGetMetadataActivity:
     def parse(self, input_data):
         typeProperties = input_data.get('typeProperties', '')
         if typeProperties:
-            ds = typeProperties.get('dataset')
+            ds = typeProperties.get('dataset') or {}
             dataset_name = ds.get('referenceName', '')
-            attr_obj = typeProperties.get('fieldList', '')
-            attr = ""
-            for i in attr_obj:
-                attr = i + ' , ' + attr
-            return 'Dataset name: {0} \n\n Metadata attributes: {1}'.format(dataset_name,attr)
+            return GetMetadataDetails(dataset_name, list(typeProperties.get('fieldList', '') or []))
 
 parse_lookup = ParseLookup()
 parse_ifcondition = ParseIfCondition()
@@ -897,12 +1965,73 @@ parse_notebook = ParseNotebookActivity()
 parse_getmetadata = ParseGetMetadataActivity()
 
 class ADFPipelineDocGenerator:
+    """
+    Walks the json of an ARM template or a single pipeline and yields one row per documented activity. The
+    instance holds the state of one walk (the current pipeline name and any materialized rows), so use a new one
+    for every document. The parsers it calls are module level and stateless, so any number of generators can run
+    at once
+    """
 
-    def __init__(self):
+    def __init__(self, instrumentation: 'Instrumentation' = None):
+        """
+        :param instrumentation: counts the nodes and activities of the walk and times each parser when given
+        """
         self.pipeline_name_flag = True
         self.pipeline_name = ''
         self.table_data = []
+        self.instrumentation = instrumentation
+
+    def iter_document(self, json_data: dict) -> Iterator[list]:
+        """
+        Lazily documents every pipeline in an ARM template, or the pipeline itself if a single pipeline file is
+        given. Rows are yielded as soon as their activity is parsed, so a writer can consume them while the walk is
+        still going and nothing is kept in memory. Rows are lists of
+        [pipeline name, task name, task type, task details, dependency info]
+
+        :param json_data: the decoded json document
+        :return: a generator of rows
+        """
+        if type(json_data.get('resources', '')) is list:
+            resource_obj = json_data.get('resources', '')
+            for data in resource_obj:
+                if data.get('type') == "Microsoft.DataFactory/factories/pipelines":
+                    yield from self.iter_recursive_parsing(data, '')
+        else:
+            yield from self.iter_recursive_parsing_Individual(json_data, '')
+
+    def parse_document(self, json_data: dict) -> list:
+        """
+        Documents every pipeline in an ARM template, or the pipeline itself if a single pipeline file is given.
+        Unlike iter_document, the rows are materialized into table_data
+
+        :param json_data: the decoded json document
+        :return: the collected rows
+        """
+        self.table_data.extend(self.iter_document(json_data))
+        return self.table_data
+
+    def store_document(self, json_data: dict, store: 'ActivityStore' = None) -> 'ActivityStore':
+        """
+        Documents a json document into a compact ActivityStore instead of table_data. Use this for large factories
+        or when the rows need to be grouped or counted afterwards
+
+        :param json_data: the decoded json document
+        :param store: an existing store to add the rows to. A new one is made if this is not given
+        :return: the store
+        """
+        store = ActivityStore() if store is None else store
+        store.extend(self.iter_document(json_data))
+        return store
+
     def recursive_parsing_Individual(self, input_data, parent_task_name):
+        self.table_data.extend(self.iter_recursive_parsing_Individual(input_data, parent_task_name))
+
+    def recursive_parsing(self, input_data, parent_task_name):
+        self.table_data.extend(self.iter_recursive_parsing(input_data, parent_task_name))
+
+    def iter_recursive_parsing_Individual(self, input_data, parent_task_name):
+        if self.instrumentation is not None:
+            self.instrumentation.count('nodes_visited')
         current_task_name = None
         for data in input_data:
             if type(input_data) is dict:
@@ -921,19 +2050,23 @@ class ADFPipelineDocGenerator:
                                 task_details = self.parse_task_details(task_type, input_data) or ''
                                 task_dependency_info = self.parse_dependsOn(
                                     input_data.get('dependsOn', '')) or parent_task_name
+                                if self.instrumentation is not None:
+                                    self.instrumentation.count_activity(task_type)
 
-                                self.table_data.append([self.pipeline_name, current_task_name, task_type, task_details,
-                                                        task_dependency_info])
+                                yield [self.pipeline_name, current_task_name, task_type, task_details,
+                                       task_dependency_info]
 
 
                 elif type(input_data.get(data, 0)) is dict:
-                    self.recursive_parsing_Individual(input_data[data], current_task_name or parent_task_name)
+                    yield from self.iter_recursive_parsing_Individual(input_data[data], current_task_name or parent_task_name)
                 elif type(input_data.get(data, 0)) is list:
-                    self.recursive_parsing_Individual(input_data[data], current_task_name or parent_task_name)
+                    yield from self.iter_recursive_parsing_Individual(input_data[data], current_task_name or parent_task_name)
             elif type(data) is dict:
-                self.recursive_parsing_Individual(data, current_task_name or parent_task_name)
+                yield from self.iter_recursive_parsing_Individual(data, current_task_name or parent_task_name)
 
-    def recursive_parsing(self, input_data, parent_task_name):
+    def iter_recursive_parsing(self, input_data, parent_task_name):
+        if self.instrumentation is not None:
+            self.instrumentation.count('nodes_visited')
         current_task_name = None
         for data in input_data:
             if type(input_data) is dict:
@@ -952,16 +2085,18 @@ class ADFPipelineDocGenerator:
                                     task_details = self.parse_task_details(task_type, input_data) or ''
                                     task_dependency_info = self.parse_dependsOn(
                                     input_data.get('dependsOn', '')) or parent_task_name
+                                    if self.instrumentation is not None:
+                                        self.instrumentation.count_activity(task_type)
 
-                                    self.table_data.append([self.pipeline_name, current_task_name, task_type, task_details,
-                                                        task_dependency_info])
+                                    yield [self.pipeline_name, current_task_name, task_type, task_details,
+                                       task_dependency_info]
 
                 elif type(input_data.get(data, 0)) is dict:
-                    self.recursive_parsing(input_data[data], current_task_name or parent_task_name)
+                    yield from self.iter_recursive_parsing(input_data[data], current_task_name or parent_task_name)
                 elif type(input_data.get(data, 0)) is list:
-                    self.recursive_parsing(input_data[data], current_task_name or parent_task_name)
+                    yield from self.iter_recursive_parsing(input_data[data], current_task_name or parent_task_name)
             elif type(data) is dict:
-                self.recursive_parsing(data, current_task_name or parent_task_name)
+                yield from self.iter_recursive_parsing(data, current_task_name or parent_task_name)
 
     def parse_dependsOn(self, dependency_list):
         if dependency_list:
@@ -975,6 +2110,12 @@ class ADFPipelineDocGenerator:
             return None
 
     def parse_task_details(self, task_type, obj):
+        if self.instrumentation is None:
+            return self._parse_task_details(task_type, obj)
+        with self.instrumentation.stage('parse.{}'.format(task_type)):
+            return self._parse_task_details(task_type, obj)
+
+    def _parse_task_details(self, task_type, obj):
             if task_type == 'Lookup':
                 return parse_lookup.parse(obj)
             elif task_type == 'IfCondition':
@@ -996,7 +2137,255 @@ class ADFPipelineDocGenerator:
             elif task_type == 'GetMetadata':
                 return parse_getmetadata.parse(obj)
 
-doc_gen = ADFPipelineDocGenerator()
+
+class ActivityRecord:
+    """
+    A read-only view of one row of an ActivityStore. It only holds the store and the row index, so making one is cheap
+    and nothing is copied out of the store until an attribute is read
+    """
+    __slots__ = ('_store', '_idx')
+
+    def __init__(self, store: 'ActivityStore', idx: int):
+        self._store = store
+        self._idx = idx
+
+    @property
+    def pipeline_name(self) -> str:
+        return self._store.value('pipeline_name', self._idx)
+
+    @property
+    def task_name(self) -> str:
+        return self._store.value('task_name', self._idx)
+
+    @property
+    def task_type(self) -> str:
+        return self._store.value('task_type', self._idx)
+
+    @property
+    def task_details(self):
+        return self._store.value('task_details', self._idx)
+
+    @property
+    def dependency_info(self) -> str:
+        return self._store.value('dependency_info', self._idx)
+
+    def as_list(self) -> list:
+        return [self._store.value(column, self._idx) for column in ActivityStore.COLUMNS]
+
+    def __repr__(self):
+        return 'ActivityRecord({})'.format(self.as_list())
+
+
+class ActivityStore:
+    """
+    A compact, columnar alternative to table_data for large factories. Every column is stored the way its values
+    actually repeat:
+
+    - pipeline names and task types only have a handful of distinct values, so they are dictionary encoded: each
+      distinct value is stored once and the rows only keep a small integer code in an array
+    - a dependency is nearly always an earlier activity of the same pipeline and its conditions, so it is kept as
+      the row index of that activity and a code for the conditions instead of a string per row. Anything else is
+      kept as it is
+    - task details are packed into one compact json bytes object per row instead of an object, a dict and a string
+      per value, and are rebuilt when they are read
+
+    Grouping or counting by an encoded column only touches the code array
+    """
+    COLUMNS = ('pipeline_name', 'task_name', 'task_type', 'task_details', 'dependency_info')
+    CATEGORICAL_COLUMNS = ('pipeline_name', 'task_type')
+    _OTHER_DEPENDENCY = -1
+
+    def __init__(self, rows: Iterator[list] = None):
+        """
+        :param rows: optional rows to load, in the same layout as ADFPipelineDocGenerator.table_data
+        """
+        self._codes = {column: array('I') for column in self.CATEGORICAL_COLUMNS}
+        self._categories = {column: [] for column in self.CATEGORICAL_COLUMNS}  # code -> value
+        self._category_codes = {column: {} for column in self.CATEGORICAL_COLUMNS}  # value -> code
+        self._task_names = []
+        self._dependency_rows = array('i')  # row index of the activity depended on, or _OTHER_DEPENDENCY
+        self._dependency_conditions = array('I')  # code into _conditions
+        self._conditions = [None]  # None is a dependency on a parent activity, without conditions
+        self._condition_codes = {None: 0}
+        self._other_dependencies = {}  # row index -> dependency info that is not a single activity
+        self._pipeline_rows = {}  # task name -> row index, for the pipeline being appended
+        self._details = []  # packed json bytes, or the value itself when _details_kinds is 0
+        self._details_kinds = array('H')  # code into _details_classes
+        self._details_classes = [None]
+        self._details_class_codes = {}
+        if rows is not None:
+            self.extend(rows)
+
+    def append(self, row: list):
+        """
+        Adds a row of [pipeline name, task name, task type, task details, dependency info] to the store
+        """
+        pipeline_name, task_name, task_type, task_details, dependency_info = row
+        idx = len(self)
+        if not self._task_names or self._categories['pipeline_name'][self._codes['pipeline_name'][-1]] \
+                != pipeline_name:
+            self._pipeline_rows = {}
+        self._encode('pipeline_name', pipeline_name)
+        self._encode('task_type', task_type)
+        self._task_names.append(task_name)
+        self._encode_details(task_details)
+        self._encode_dependency(idx, dependency_info)
+        self._pipeline_rows[task_name] = idx
+
+    def extend(self, rows: Iterator[list]):
+        for row in rows:
+            self.append(row)
+
+    def _encode(self, column: str, value):
+        category_codes = self._category_codes[column]
+        code = category_codes.get(value)
+        if code is None:
+            code = category_codes[value] = len(self._categories[column])
+            self._categories[column].append(value)
+        self._codes[column].append(code)
+
+    def _encode_dependency(self, idx: int, dependency_info):
+        # 'activity:conditions' or just the parent activity's name. Activity names can't contain ':'
+        row = None
+        if isinstance(dependency_info, str):
+            name, separator, conditions = dependency_info.partition(':')
+            if ':' not in conditions:  # more than one dependency
+                row = self._pipeline_rows.get(name)
+        if row is None:
+            self._dependency_rows.append(self._OTHER_DEPENDENCY)
+            self._dependency_conditions.append(0)
+            self._other_dependencies[idx] = dependency_info
+            return
+        condition = conditions if separator else None
+        code = self._condition_codes.get(condition)
+        if code is None:
+            code = self._condition_codes[condition] = len(self._conditions)
+            self._conditions.append(condition)
+        self._dependency_rows.append(row)
+        self._dependency_conditions.append(code)
+
+    def _encode_details(self, details):
+        if isinstance(details, ActivityDetails):
+            details_cls = type(details)
+            try:
+                packed = json.dumps([getattr(details, slot) for slot in details_cls.__slots__], ensure_ascii=False,
+                                    separators=(',', ':')).encode('utf-8', 'surrogatepass')
+            except (TypeError, ValueError):
+                packed = None
+            if packed is not None and self._unpack_details(details_cls, packed) == details:
+                code = self._details_class_codes.get(details_cls)
+                if code is None:
+                    code = self._details_class_codes[details_cls] = len(self._details_classes)
+                    self._details_classes.append(details_cls)
+                self._details.append(packed)
+                self._details_kinds.append(code)
+                return
+        self._details.append(details)  # not an ActivityDetails, or a value json can't carry exactly
+        self._details_kinds.append(0)
+
+    @staticmethod
+    def _unpack_details(details_cls, packed: bytes) -> ActivityDetails:
+        details = details_cls.__new__(details_cls)
+        for slot, value in zip(details_cls.__slots__, json.loads(packed)):
+            setattr(details, slot, value)
+        return details
+
+    def value(self, column: str, idx: int):
+        """
+        Gets the value of a single cell
+
+        :param column: one of ActivityStore.COLUMNS
+        :param idx: the row index
+        """
+        if column in self._codes:
+            return self._categories[column][self._codes[column][idx]]
+        if column == 'task_name':
+            return self._task_names[idx]
+        if column == 'task_details':
+            code = self._details_kinds[idx]
+            if code == 0:
+                return self._details[idx]
+            return self._unpack_details(self._details_classes[code], self._details[idx])
+        if column == 'dependency_info':
+            row = self._dependency_rows[idx]
+            if row == self._OTHER_DEPENDENCY:
+                return self._other_dependencies[idx]
+            condition = self._conditions[self._dependency_conditions[idx]]
+            name = self._task_names[row]
+            return name if condition is None else name + ':' + condition
+        raise ValueError("Unknown column {}. Expected one of {}".format(column, ', '.join(self.COLUMNS)))
+
+    def column(self, column: str) -> list:
+        """
+        Decodes a whole column into a list of values
+        """
+        if column in self._codes:
+            categories = self._categories[column]
+            return [categories[code] for code in self._codes[column]]
+        if column == 'task_name':
+            return list(self._task_names)
+        if column in self.COLUMNS:
+            return [self.value(column, idx) for idx in range(len(self))]
+        raise ValueError("Unknown column {}. Expected one of {}".format(column, ', '.join(self.COLUMNS)))
+
+    def distinct(self, column: str) -> list:
+        """
+        The distinct values of a column, in the order they were first seen
+        """
+        if column in self._categories:
+            return list(self._categories[column])
+        return list(dict.fromkeys(self.column(column)))
+
+    def count_by(self, column: str) -> Dict[str, int]:
+        """
+        Counts the rows per value of a column, e.g. count_by('task_type') gives the number of activities per type
+        """
+        if column in self._codes:
+            categories = self._categories[column]
+            return {categories[code]: count for code, count in Counter(self._codes[column]).items()}
+        return dict(Counter(self.column(column)))
+
+    def group_by(self, column: str) -> Dict[str, array]:
+        """
+        Groups the row indices per value of a column, e.g. group_by('pipeline_name') gives the rows of every pipeline.
+        Use store[idx] to get the record of an index
+
+        :return: a dictionary of value to an array of row indices
+        """
+        if column in self._codes:
+            groups = [array('I') for _ in self._categories[column]]
+            for idx, code in enumerate(self._codes[column]):
+                groups[code].append(idx)
+            return dict(zip(self._categories[column], groups))
+        groups = {}
+        for idx, value in enumerate(self.column(column)):
+            groups.setdefault(value, array('I')).append(idx)
+        return groups
+
+    def iter_rows(self) -> Iterator[list]:
+        """
+        Yields the rows as lists, in the same layout as table_data, so the store can be handed to any writer
+        """
+        for idx in range(len(self)):
+            yield [self.value(column, idx) for column in self.COLUMNS]
+
+    def __len__(self):
+        return len(self._task_names)
+
+    def __getitem__(self, idx: int) -> ActivityRecord:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("ActivityStore index {} out of range".format(idx))
+        return ActivityRecord(self, idx)
+
+    def __iter__(self) -> Iterator[ActivityRecord]:
+        for idx in range(len(self)):
+            yield ActivityRecord(self, idx)
+
+
+DOC_HEADERS = ['Pipeline Name', 'Task Name', 'Type', 'Details', 'Depency Task: Condition']
+
 
 def get_initial_row_formatting(initial_row):
     # format the excel
@@ -1029,29 +2418,679 @@ def get_rest_rows_formatting(start_position, formatted_row):
             rest_rows_instruction['column'][str(i)]["cell_borders"]= ["right"]
     return rest_rows_instruction
 
-file = sys.argv[1]
-with open(file) as json_data_file:
-    json_data = json.load(json_data_file)
-    if type(json_data.get('resources', '')) is list:
-        resource_obj = json_data.get('resources', '')
-        for data in resource_obj:
-            if data.get('type') == "Microsoft.DataFactory/factories/pipelines":
-                doc_gen.recursive_parsing(data, '')
+def open_output_writer(output_format: str, path: Union[str, BinaryIO, None], headers: list,
+                       sheet_name: str = 'Sheet1', instrumentation: 'Instrumentation' = None):
+    """
+    Creates the writer for the requested output format and writes the header row. The Excel output keeps its header
+    formatting, the other writers just record the headers as column names
+
+    :param output_format: one of the keys of OUTPUT_WRITERS
+    :param path: where the output is written. A file-like object or None keeps the output in memory
+    :param headers: the column headers
+    :param sheet_name: the sheet (or table) name of the output
+    :param instrumentation: an Instrumentation to count the cells (and formats) the writer writes
+    :return: the open writer, ready for write_row calls
+    """
+    writer_cls = OUTPUT_WRITERS.get(output_format)
+    if writer_cls is None:
+        raise ValueError("Unknown output format {}. Expected one of {}".format(output_format,
+                                                                              ', '.join(OUTPUT_WRITERS)))
+    writer = writer_cls()
+    writer.instrumentation = instrumentation
+    if output_format == 'xlsx':
+        initial_row_formatting = get_initial_row_formatting(headers)
+        # the rows are written in order, so a workbook on disk is flushed row by row
+        writer.create_new(path, [headers], overwrite=True, sheet_name=sheet_name, instructions=initial_row_formatting,
+                          constant_memory=True)
     else:
-        doc_gen.recursive_parsing_Individual(json_data, '')
-
-    xl_utility = ExcelUtils()
-    now = datetime.now()
-    formatted_date = now.strftime("%Y-%m-%d-%H-%M-%S-%f")[:-3]
-    file_name = '{}_{}.xlsx'.format(file[:-5], formatted_date)
-    temp_path = os.path.join(pathlib.Path().absolute(), file_name)
-
-    headers = ['Pipeline Name', 'Task Name', 'Type', 'Details', 'Depency Task: Condition']
-    initial_row_formatting = get_initial_row_formatting(headers)
-    xl_utility.create_new(temp_path, [headers], overwrite=True, instructions=initial_row_formatting)
-    for j, row in enumerate(doc_gen.table_data):
-        formatted_row = [''] * len(headers)
-        each_row_formatting = get_rest_rows_formatting(1, formatted_row)
-        xl_utility.write_row(row, instructions=each_row_formatting)
-    xl_utility.close_workbook()
+        writer.create_new(path, [], overwrite=True, sheet_name=sheet_name, separate_headers=headers)
+    return writer
+
+
+class Instrumentation:
+    """
+    Opt-in timing and counters for one generate run. Every stage of the run - json decoding, the tree walk, each
+    parser, instruction resolution, add_format, writing and closing the output - is timed in wall and CPU seconds,
+    and the nodes visited, activities per type, cells written and formats created are counted. Stages nest: the
+    tree_walk time includes the parse.<type> stages and write_row includes add_format and
+    _convert_instructions_to_formats. When no instance is given the hot paths only pay for a None check.
+
+    Use a new instance for every run, it is not thread safe. The report is a plain dict so it can be dumped as json
+    and shipped to a metrics pipeline
+    """
+    PROFILE_TOP = 30
+
+    def __init__(self, callback: Callable[[str, dict], None] = None, report_path: str = None,
+                 profile: bool = False, profile_path: str = None, track_memory: bool = False):
+        """
+        :param callback: called as callback('stage', {'stage': name, 'wall': seconds, 'cpu': seconds}) after every
+            timed stage block and as callback('report', report) at the end of the run
+        :param report_path: if given, the json report is written to this path at the end of the run
+        :param profile: capture a cProfile of the run. The top functions by cumulative time go into the report
+        :param profile_path: also dump the raw cProfile stats to this path (implies profile), for pstats or snakeviz
+        :param track_memory: trace allocations with tracemalloc to report the peak Python memory. This slows the run
+            down noticeably so it is off by default. The peak RSS of the process is always reported where available
+        """
+        self.callback = callback
+        self.report_path = report_path
+        self.profile = profile or profile_path is not None
+        self.profile_path = profile_path
+        self.track_memory = track_memory
+        self.stages = {}  # stage name -> [calls, wall seconds, cpu seconds]
+        self.counters = Counter()
+        self.activities = Counter()
+        self.report = None
+        self._started = None
+        self._started_at = None
+        self._profiler = None
+        self._owns_tracemalloc = False
+
+    def start(self):
+        """
+        Starts the run clock, and the profiler and memory tracing if they were asked for
+        """
+        self._started_at = datetime.now().isoformat()
+        if self.track_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracemalloc = True
+        if self.profile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError as e:  # another profiler is already active
+                print('Unable to start the profiler, continuing without it. Error: {}'.format(e))
+                self._profiler = None
+        self._started = (time.perf_counter(), time.process_time())
+
+    def finish(self) -> dict:
+        """
+        Stops the run, builds the report, writes it to report_path and hands it to the callback
+
+        :return: the report
+        """
+        wall = time.perf_counter() - self._started[0]
+        cpu = time.process_time() - self._started[1]
+        peak_memory = None
+        if self.track_memory:
+            import tracemalloc
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+                self._owns_tracemalloc = False
+        profile = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            profile = self._profile_summary()
+            if self.profile_path:
+                self._profiler.dump_stats(self.profile_path)
+            self._profiler = None
+
+        self.report = {
+            'started_at': self._started_at,
+            'wall': wall,
+            'cpu': cpu,
+            'stages': {name: {'calls': calls, 'wall': stage_wall, 'cpu': stage_cpu}
+                       for name, (calls, stage_wall, stage_cpu) in self.stages.items()},
+            'counters': dict(self.counters),
+            'activities': dict(self.activities),
+            'peak_memory': peak_memory,
+            'peak_rss': self._peak_rss(),
+            'profile': profile,
+        }
+        if self.report_path:
+            with open(self.report_path, 'w') as f:
+                json.dump(self.report, f, indent=2)
+        if self.callback is not None:
+            self.callback('report', self.report)
+        return self.report
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Times the block as one call of the stage `name` and reports it to the callback
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.add_time(name, wall, cpu)
+            if self.callback is not None:
+                self.callback('stage', {'stage': name, 'wall': wall, 'cpu': cpu})
+
+    def call(self, name: str, func: Callable, *args):
+        """
+        Calls func(*args) as one call of the stage `name`. Cheaper than stage() and the callback is not called, so
+        this is what the per cell hot paths use
+
+        :return: what func returned
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func(*args)
+        self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+        return result
+
+    def timed_iter(self, name: str, iterable) -> Iterator:
+        """
+        Yields the items of `iterable`, timing the production of every item as one call of the stage `name`. Used
+        to time the lazy tree walk separately from the writer consuming it
+        """
+        iterator = iter(iterable)
+        while True:
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+            yield item
+
+    def add_time(self, name: str, wall: float, cpu: float):
+        totals = self.stages.get(name)
+        if totals is None:
+            totals = self.stages[name] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += wall
+        totals[2] += cpu
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def count_activity(self, task_type: str):
+        self.activities[task_type] += 1
+
+    def _profile_summary(self) -> List[dict]:
+        import pstats
+        stats = pstats.Stats(self._profiler).stats
+        top = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:self.PROFILE_TOP]
+        return [{'function': '{}:{}({})'.format(*key), 'calls': calls, 'primitive_calls': primitive_calls,
+                 'tottime': tottime, 'cumtime': cumtime}
+                for key, (primitive_calls, calls, tottime, cumtime, _) in top]
+
+    @staticmethod
+    def _peak_rss() -> Union[int, None]:
+        """
+        :return: the peak resident memory of the process in bytes, or None where the resource module is missing
+        """
+        try:
+            import resource
+        except ImportError:  # Windows
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024  # kilobytes everywhere but macOS
+
+
+def _stage(instrumentation: Union[Instrumentation, None], name: str):
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.stage(name)
+
+
+class GenerateOptions:
+
+    def __init__(self, output_format: str = 'xlsx', sheet_name: str = 'Sheet1',
+                 instrumentation: Instrumentation = None):
+        """
+        Options for a single generate call
+
+        :param output_format: one of the keys of OUTPUT_WRITERS. Defaults to an Excel workbook
+        :param sheet_name: the sheet (or table) name of the output
+        :param instrumentation: an Instrumentation to time and count the run. Nothing is measured by default
+        """
+        if output_format not in OUTPUT_WRITERS:
+            raise ValueError("Unknown output format {}. Expected one of {}".format(output_format,
+                                                                                  ', '.join(OUTPUT_WRITERS)))
+        self.output_format = output_format
+        self.sheet_name = sheet_name
+        self.instrumentation = instrumentation
+
+
+def _orjson_loads() -> Callable:
+    import orjson
+    return orjson.loads
+
+
+def _simdjson_loads() -> Callable:
+    import simdjson
+    return simdjson.loads
+
+
+# backend name -> a function returning its loads, or raising ImportError when it is not installed. The first
+# installed backend is used unless set_json_decoder picks one; add entries here to plug in another backend
+JSON_DECODERS = OrderedDict([
+    ('orjson', _orjson_loads),
+    ('simdjson', _simdjson_loads),
+    ('json', lambda: json.loads),
+])
 
+_json_decoder = None  # (name, loads) of the backend in use, picked on first use
+_UTF8_BOM = b'\xef\xbb\xbf'
+# integers this long may not fit in 64 bits, which the fast backends turn into floats
+_LONG_NUMBER = b'0' * 19
+_DIGITS_TO_ZERO = bytes.maketrans(b'123456789', b'000000000')
+_SCAN_CHUNK = 1 << 20
+
+
+def set_json_decoder(name: str = None) -> str:
+    """
+    Picks the json backend used by decode_json
+
+    :param name: a key of JSON_DECODERS, or None for the first one that is installed
+    :return: the name of the backend in use
+    """
+    global _json_decoder
+    if name is not None and name not in JSON_DECODERS:
+        raise ValueError("Unknown json decoder {}. Expected one of {}".format(name, ', '.join(JSON_DECODERS)))
+    for candidate in [name] if name else list(JSON_DECODERS):
+        try:
+            _json_decoder = (candidate, JSON_DECODERS[candidate]())
+            return candidate
+        except ImportError:
+            if name:
+                raise RuntimeError("The {} json decoder is not installed".format(name))
+    raise RuntimeError("None of the json decoders could be loaded")
+
+
+def _has_long_number(data) -> bool:
+    """
+    Whether a run of 19 or more digits appears anywhere in the document. Every digit is mapped to 0 with
+    bytes.translate and the run searched for, which is many times faster than a regex. Buffers are scanned in
+    chunks so a memory mapped file is never copied whole
+    """
+    if isinstance(data, bytes):
+        return _LONG_NUMBER in data.translate(_DIGITS_TO_ZERO)
+    overlap = len(_LONG_NUMBER) - 1
+    for start in range(0, len(data), _SCAN_CHUNK):
+        if _LONG_NUMBER in bytes(data[start:start + _SCAN_CHUNK + overlap]).translate(_DIGITS_TO_ZERO):
+            return True
+    return False
+
+
+def _fast_decode(loads: Callable, data):
+    # kept out of decode_json so no slice of a memory mapped buffer outlives the call
+    if isinstance(data, str):  # decode_json has already skipped a BOM, a second one has to stay an error
+        data = data.encode('utf-8', 'surrogatepass')
+    elif data[:3] == _UTF8_BOM:
+        data = data[3:]
+    if _has_long_number(data):
+        return False, None
+    try:
+        return True, loads(data)
+    except ValueError:
+        return False, None
+
+
+def decode_json(data: Union[bytes, str, memoryview]):
+    """
+    Decodes a json document with the fastest installed backend. Documents the fast backend would decode differently
+    from the json module (integers past 64 bits) or rejects (NaN, lone surrogates, invalid json) are decoded by the
+    json module instead, so the result, and any error raised, is the same whichever backend is used. A leading BOM
+    is skipped for every backend, which json.loads already does for bytes but not for a str
+
+    :param data: the document as bytes, a str or a buffer such as a memoryview of a memory mapped file
+    :return: the decoded document
+    """
+    if _json_decoder is None:
+        set_json_decoder()
+    name, loads = _json_decoder
+    if isinstance(data, str) and data[:1] == '\ufeff':
+        data = data[1:]
+    if name != 'json':
+        decoded, result = _fast_decode(loads, data)
+        if decoded:
+            return result
+    if not isinstance(data, (bytes, str)):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def load_json_file(path: Union[str, os.PathLike]):
+    """
+    Decodes a json file through a read-only memory map, so it is handed to the decoder without being read into a
+    text file object first
+
+    :param path: the path of the json file
+    :return: the decoded document
+    """
+    with open(path, 'rb') as json_data_file:
+        if os.fstat(json_data_file.fileno()).st_size == 0:
+            return decode_json(b'')  # an empty file can't be mapped; raises the same error json.load would
+        with mmap.mmap(json_data_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            view = memoryview(buffer)
+            try:
+                return decode_json(view)
+            finally:
+                view.release()
+
+
+def _load_source(source) -> dict:
+    if isinstance(source, dict):
+        return source
+    if isinstance(source, (str, os.PathLike)):
+        return load_json_file(source)
+    return decode_json(source.read())
+
+
+def generate(source, sink: Union[str, BinaryIO, None] = None,
+             options: GenerateOptions = None) -> Union[str, bytes, None]:
+    """
+    Documents the pipelines of an ARM template (or a single pipeline file) and writes the rows to `sink`. Every call
+    builds its own generator and writer, so it is safe to call from several threads at once. Rows are streamed from
+    the walk to the writer, so memory stays flat with factory size, except for an Excel workbook built in memory
+    (a file-like or None sink), which xlsxwriter can only assemble once every cell is known
+
+    :param source: a path to a json file, an open json file object or an already decoded json document
+    :param sink: the path to write to, a binary file-like object, or None to build the output in memory
+    :param options: a GenerateOptions instance. Defaults to an Excel workbook
+    :return: the sink path if a path was given, the output bytes if the sink was None or a BytesIO and None
+        for any other file-like sink
+    """
+    options = options or GenerateOptions()
+    instrumentation = options.instrumentation
+    if instrumentation is not None:
+        instrumentation.start()
+    try:
+        with _stage(instrumentation, 'json_decode'):
+            json_data = _load_source(source)
+
+        with _stage(instrumentation, 'open_output'):
+            writer = open_output_writer(options.output_format, sink, DOC_HEADERS, options.sheet_name,
+                                        instrumentation)
+        each_row_formatting = get_rest_rows_formatting(1, [''] * len(DOC_HEADERS))
+        rows = ADFPipelineDocGenerator(instrumentation).iter_document(json_data)
+        if instrumentation is None:
+            for row in rows:
+                writer.write_row(row, instructions=each_row_formatting)
+        else:
+            for row in instrumentation.timed_iter('tree_walk', rows):
+                instrumentation.call('write_row', writer.write_row, row, None, each_row_formatting)
+        with _stage(instrumentation, 'close_workbook'):
+            output_bytes = writer.close_workbook()
+    finally:
+        if instrumentation is not None:
+            instrumentation.finish()
+    return sink if isinstance(sink, str) else output_bytes
+
+
+def export_documentation(file: str, output_format: str = 'xlsx', output: BinaryIO = None,
+                         instrumentation: Instrumentation = None) -> Union[str, bytes, None]:
+    """
+    Documents every pipeline of an ARM template (or a single pipeline file) and writes the rows to a timestamped
+    file next to the current working directory, or to the file-like `output` if one is given
+
+    :param file: the path to the json file to document
+    :param output_format: one of the keys of OUTPUT_WRITERS. Defaults to an Excel workbook
+    :param output: a binary file-like object (a BytesIO or a response stream for instance) to write to instead of
+        a file on disk
+    :param instrumentation: an Instrumentation to time and count the run
+    :return: the path of the written output. When writing to `output`, the written bytes if it is a BytesIO and
+        None otherwise
+    """
+    if output is None:
+        now = datetime.now()
+        formatted_date = now.strftime("%Y-%m-%d-%H-%M-%S-%f")[:-3]
+        file_name = '{}_{}.{}'.format(file[:-5], formatted_date, OUTPUT_WRITERS[output_format].extension)
+        temp_path = os.path.join(os.getcwd(), file_name)
+    else:
+        temp_path = output
+    return generate(file, temp_path, GenerateOptions(output_format, instrumentation=instrumentation))
+
+
+def export_documentation_bytes(file: str, output_format: str = 'xlsx') -> bytes:
+    """
+    Same as export_documentation but builds the whole output in memory and returns its bytes, so a service can
+    send the export back without writing, re-reading and deleting a temp file
+
+    :param file: the path to the json file to document
+    :param output_format: one of the keys of OUTPUT_WRITERS. SQLite needs a file on disk so it is not supported here
+    :return: the finished output as bytes
+    """
+    return export_documentation(file, output_format, output=io.BytesIO())
+
+
+EXCEL_MAX_ROWS = 1048576
+SHARD_KEYS = ('factory', 'pipeline', 'rows')
+SHARD_LAYOUTS = ('files', 'sheets')
+SHARD_INDEX_HEADERS = ['Shard', 'File', 'Sheet', 'Source', 'Rows', 'First Pipeline', 'Last Pipeline']
+
+
+def _shard_label(text: str, max_length: int = 100) -> str:
+    """
+    Makes a pipeline or file name safe to use in a file or sheet name
+    """
+    label = ''.join(char if char.isalnum() or char in '-_' else '_' for char in str(text))
+    return label[:max_length] or 'shard'
+
+
+def _source_label(source, idx: int) -> str:
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.splitext(os.path.basename(source))[0]
+    return getattr(source, 'name', None) or 'source_{}'.format(idx)
+
+
+def iter_shards(sources: list, shard_by: str = 'factory',
+                max_rows: int = EXCEL_MAX_ROWS) -> Iterator[Tuple[str, List[str], list]]:
+    """
+    Documents the sources and splits their rows into shards. A shard holds the rows of one source ('factory'), of
+    one pipeline ('pipeline') or just the next max_rows - 1 rows across all sources ('rows'). A factory or pipeline
+    with more rows than that is split into numbered parts, so every shard fits in a sheet along with its header
+    row. Only the shard being filled is kept in memory
+
+    :param sources: paths, open json files or decoded json documents
+    :param shard_by: one of SHARD_KEYS
+    :param max_rows: the most rows a shard can have, including the header row. Defaults to Excel's sheet limit
+    :return: a generator of (shard name, labels of the sources in the shard, rows)
+    """
+    if shard_by not in SHARD_KEYS:
+        raise ValueError("Unknown shard key {}. Expected one of {}".format(shard_by, ', '.join(SHARD_KEYS)))
+    if max_rows < 2:
+        raise ValueError("max_rows must leave room for the header row and at least one row")
+    limit = max_rows - 1
+    shard_key, label, shard_sources, rows, part = None, None, [], [], 0
+
+    def shard_name():
+        return label if part == 0 and shard_by != 'rows' else '{}_{}'.format(label, part + 1)
+
+    for idx, source in enumerate(sources):
+        source_label = _source_label(source, idx)
+        for row in ADFPipelineDocGenerator().iter_document(_load_source(source)):
+            if shard_by == 'factory':
+                key = idx
+            elif shard_by == 'pipeline':
+                key = (idx, row[0])
+            else:
+                key = None
+            if rows and (key != shard_key or len(rows) == limit):
+                yield shard_name(), shard_sources, rows
+                part = part + 1 if key == shard_key else 0
+                rows, shard_sources = [], []
+            if not rows:
+                shard_key = key
+                label = source_label if shard_by == 'factory' else row[0] if shard_by == 'pipeline' else 'rows'
+            if not shard_sources or shard_sources[-1] != source_label:
+                shard_sources.append(source_label)
+            rows.append(row)
+    if rows:
+        yield shard_name(), shard_sources, rows
+
+
+def _write_shard(output_format: str, path: str, sheet_name: str, rows: list) -> int:
+    """
+    Writes one shard to its own file. Runs in a worker process, so it only takes picklable arguments
+
+    :return: the number of rows written
+    """
+    writer = open_output_writer(output_format, path, DOC_HEADERS, sheet_name)
+    each_row_formatting = get_rest_rows_formatting(1, [''] * len(DOC_HEADERS))
+    for row in rows:
+        writer.write_row(row, instructions=each_row_formatting)
+    writer.close_workbook()
+    return len(rows)
+
+
+def _write_shard_index(path: str, entries: List[list]):
+    writer = open_output_writer('xlsx', path, SHARD_INDEX_HEADERS, 'Shards')
+    for entry in entries:
+        writer.write_row(entry)
+    writer.close_workbook()
+
+
+def generate_sharded(sources, output_dir: str, options: GenerateOptions = None, shard_by: str = 'factory',
+                     max_rows: int = EXCEL_MAX_ROWS, layout: str = 'files', workers: int = None) -> str:
+    """
+    Documents one or more factories into several outputs instead of one, so large exports stay within Excel's row
+    limit and are written on every core. The rows are split by iter_shards. With the 'files' layout every shard
+    is written to its own file by a pool of worker processes; with the 'sheets' layout (Excel only) every shard
+    gets its own sheet of a single workbook, which one process has to write. Either way an index.xlsx listing the
+    shards is written next to them.
+
+    The tree walk itself stays in this process and the shards are handed to the workers as they fill up, with at
+    most two per worker waiting, so memory stays bounded by a few shards. Instrumentation is not supported here
+
+    :param sources: a path, open json file or decoded json document, or a list of them
+    :param output_dir: the directory to write the shards and the index to. It is created if it does not exist
+    :param options: the output format. The sheet name is used for every file of the 'files' layout
+    :param shard_by: one of SHARD_KEYS
+    :param max_rows: the most rows per shard, including the header row. Defaults to Excel's sheet limit
+    :param layout: one of SHARD_LAYOUTS
+    :param workers: the number of worker processes for the 'files' layout. Defaults to the number of cores and
+        1 writes the shards in this process
+    :return: the path of the index workbook
+    """
+    options = options or GenerateOptions()
+    if layout not in SHARD_LAYOUTS:
+        raise ValueError("Unknown shard layout {}. Expected one of {}".format(layout, ', '.join(SHARD_LAYOUTS)))
+    if layout == 'sheets' and options.output_format != 'xlsx':
+        raise ValueError("The sheets layout needs the xlsx output format")
+    if isinstance(sources, (str, os.PathLike, dict)) or hasattr(sources, 'read'):
+        sources = [sources]
+    os.makedirs(output_dir, exist_ok=True)
+    extension = OUTPUT_WRITERS[options.output_format].extension
+    shards = iter_shards(sources, shard_by, max_rows)
+    entries = []
+
+    def index_entry(idx, file_name, sheet_name, shard_sources, rows):
+        return [idx + 1, file_name, sheet_name, ', '.join(shard_sources), len(rows), rows[0][0], rows[-1][0]]
+
+    if layout == 'sheets':
+        file_name = 'shards.{}'.format(extension)
+        writer = ExcelUtils()
+        initial_row_formatting = get_initial_row_formatting(DOC_HEADERS)
+        each_row_formatting = get_rest_rows_formatting(1, [''] * len(DOC_HEADERS))
+        for idx, (name, shard_sources, rows) in enumerate(shards):
+            sheet_name = '{:03d}_{}'.format(idx + 1, _shard_label(name))[:31]  # Excel's sheet name limit
+            if idx == 0:
+                writer.create_new(os.path.join(output_dir, file_name), [DOC_HEADERS], overwrite=True,
+                                  sheet_name=sheet_name, instructions=initial_row_formatting, constant_memory=True)
+            else:
+                writer.create_new_sheet([DOC_HEADERS], sheet_name=sheet_name, instructions=initial_row_formatting)
+            for row in rows:
+                writer.write_row(row, instructions=each_row_formatting)
+            entries.append(index_entry(idx, file_name, sheet_name, shard_sources, rows))
+        if entries:
+            writer.close_workbook()
+    elif workers == 1:
+        for idx, (name, shard_sources, rows) in enumerate(shards):
+            file_name = '{:03d}_{}.{}'.format(idx + 1, _shard_label(name), extension)
+            _write_shard(options.output_format, os.path.join(output_dir, file_name), options.sheet_name, rows)
+            entries.append(index_entry(idx, file_name, options.sheet_name, shard_sources, rows))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        workers = workers or os.cpu_count() or 1
+        max_pending = 2 * workers
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            futures = []
+            for idx, (name, shard_sources, rows) in enumerate(shards):
+                file_name = '{:03d}_{}.{}'.format(idx + 1, _shard_label(name), extension)
+                future = executor.submit(_write_shard, options.output_format, os.path.join(output_dir, file_name),
+                                         options.sheet_name, rows)
+                futures.append(future)
+                pending.add(future)
+                entries.append(index_entry(idx, file_name, options.sheet_name, shard_sources, rows))
+                if len(pending) >= max_pending:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in futures:
+                future.result()  # raises the first error of a worker
+
+    index_path = os.path.join(output_dir, 'index.xlsx')
+    _write_shard_index(index_path, entries)
+    print("Wrote {} shard(s) to {}".format(len(entries), output_dir))
+    return index_path
+
+
+SUBCOMMANDS = ('generate', 'shard', 'headers')
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    The command line entry point. `initiator.py <file>` without a subcommand is still accepted and runs generate
+
+    :param argv: the arguments, without the program name. Defaults to sys.argv
+    :return: the exit code
+    """
+    import argparse
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] not in SUBCOMMANDS and argv[0] not in ('-h', '--help'):
+        argv.insert(0, 'generate')
+
+    arg_parser = argparse.ArgumentParser(prog='initiator',
+                                         description='Generates documentation for Azure Data Factory pipelines')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser('generate', help='document an ARM template or a single pipeline')
+    generate_parser.add_argument('file', help='an ARM template or a single pipeline json file')
+    generate_parser.add_argument('--format', dest='output_format', default='xlsx', choices=list(OUTPUT_WRITERS),
+                                 help='the output format. Defaults to an Excel workbook')
+    generate_parser.add_argument('--output', help='where to write the output. Defaults to a timestamped file in '
+                                                  'the current directory')
+    generate_parser.add_argument('--report', metavar='PATH', help='time and count the run and write a json report '
+                                                                  'to PATH')
+    generate_parser.add_argument('--profile', metavar='PATH', help='capture a cProfile of the run to PATH. The top '
+                                                                   'functions are also added to the report')
+    generate_parser.add_argument('--track-memory', action='store_true',
+                                 help='report the peak Python memory of the run. Slows the run down')
+    shard_parser = subparsers.add_parser('shard', help='document one or more factories into several files or '
+                                                       'sheets, written in parallel')
+    shard_parser.add_argument('files', nargs='+', help='ARM templates or single pipeline json files')
+    shard_parser.add_argument('--output-dir', required=True, help='the directory to write the shards and the '
+                                                                  'index workbook to')
+    shard_parser.add_argument('--format', dest='output_format', default='xlsx', choices=list(OUTPUT_WRITERS),
+                              help='the output format. Defaults to Excel workbooks')
+    shard_parser.add_argument('--by', dest='shard_by', default='factory', choices=SHARD_KEYS,
+                              help='what each shard holds. Defaults to one factory per shard')
+    shard_parser.add_argument('--max-rows', type=int, default=EXCEL_MAX_ROWS,
+                              help='the most rows per shard, including the header. Defaults to the Excel limit')
+    shard_parser.add_argument('--layout', default='files', choices=SHARD_LAYOUTS,
+                              help='a file per shard, or a sheet per shard of one workbook')
+    shard_parser.add_argument('--workers', type=int, help='worker processes. Defaults to the number of cores')
+    headers_parser = subparsers.add_parser('headers', help='print the column headers of the first sheet of a '
+                                                           'workbook')
+    headers_parser.add_argument('workbook', help='an .xls or .xlsx workbook')
+    args = arg_parser.parse_args(argv)
+
+    if args.command == 'generate':
+        instrumentation = None
+        if args.report or args.profile or args.track_memory:
+            instrumentation = Instrumentation(report_path=args.report, profile_path=args.profile,
+                                              track_memory=args.track_memory)
+        if args.output:
+            generate(args.file, args.output, GenerateOptions(args.output_format, instrumentation=instrumentation))
+        else:
+            export_documentation(args.file, args.output_format, instrumentation=instrumentation)
+        if instrumentation is not None and not args.report:
+            print(json.dumps(instrumentation.report, indent=2))
+    elif args.command == 'shard':
+        generate_sharded(args.files, args.output_dir, GenerateOptions(args.output_format), args.shard_by,
+                         args.max_rows, args.layout, args.workers)
+    elif args.command == 'headers':
+        for header in ExcelUtils().get_uploaded_file_columns(args.workbook):
+            print(header)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())